@@ -48,6 +48,9 @@ from libs.client import SharedGroupManager
 from libs.client import Footprint
 
 from cpu import GroupKeyManager
+from cpu import OutboundScheduler
+from cpu import KeyQueryTracker
+from cpu import GroupMembershipCache
 from cpu import GroupMessageDistributor, GroupMessageHandler
 
 
@@ -112,6 +115,9 @@ class GlobalVariable:
         gm_dis = GroupMessageDistributor()
         gm_han.messenger = transceiver
         gm_dis.messenger = transceiver
+        # set for outbound scheduler
+        scheduler = OutboundScheduler()
+        scheduler.messenger = transceiver
 
     async def prepare(self, config: Config):
         #
@@ -148,9 +154,45 @@ class GlobalVariable:
         # set for group message handler
         gm_han = GroupMessageHandler()
         gm_han.facebook = facebook
+        workers = config.get_integer(section='group', option='workers')
+        if workers > 0:
+            gm_han.workers = workers
         # set for group message handlers
         gm_dis = GroupMessageDistributor()
         gm_dis.database = database
+        batch_count = config.get_integer(section='group', option='forward_count')
+        if batch_count > 0:
+            gm_dis.batch_count = batch_count
+        batch_size = config.get_integer(section='group', option='forward_size')
+        if batch_size > 0:
+            gm_dis.batch_size = batch_size
+        page_size = config.get_integer(section='group', option='inbox_page')
+        if page_size > 0:
+            gm_dis.page_size = page_size
+        queue_limit = config.get_integer(section='group', option='queue_limit')
+        if queue_limit > 0:
+            gm_dis.queue_limit = queue_limit
+        queue_memory = config.get_integer(section='group', option='queue_memory')
+        if queue_memory > 0:
+            gm_dis.queue_memory = queue_memory
+        # set for outbound scheduler
+        scheduler = OutboundScheduler()
+        send_rate = config.get_integer(section='group', option='send_rate')
+        if send_rate > 0:
+            scheduler.rate = send_rate
+        send_burst = config.get_integer(section='group', option='send_burst')
+        if send_burst > 0:
+            scheduler.burst = send_burst
+        receipt_window = config.get_integer(section='group', option='receipt_window')
+        if receipt_window > 0:
+            scheduler.receipt_window = receipt_window / 1000.0
+        # set for group key query tracker
+        tracker = KeyQueryTracker()
+        key_cooldown = config.get_integer(section='group', option='key_query_cooldown')
+        if key_cooldown > 0:
+            tracker.cooldown = key_cooldown
+        # group membership snapshots expire when members saved
+        database.add_group_listener(listener=GroupMembershipCache().invalidate)
         # set for group key handler
         key_man = GroupKeyManager()
         key_man.database = database
@@ -260,6 +302,8 @@ async def start_bot(ans_name: str, processor_class) -> Terminal:
     client = BotClient(facebook=shared.facebook, database=shared.sdb, processor_class=processor_class)
     await client.connect(host=host, port=port)
     await client.run()
+    # save active users before exit
+    await Footprint().flush()
     return client
 
 
@@ -25,6 +25,9 @@
 
 from .customized import GroupKeyManager, GroupKeyHandler
 
+from .tracker import KeyQueryTracker
+from .membership import GroupMembership, GroupMembershipCache
+from .scheduler import OutboundScheduler
 from .distributor import GroupMessageDistributor
 from .handler import GroupMessageHandler
 from .forward import ForwardContentProcessor
@@ -34,6 +37,9 @@ __all__ = [
 
     'GroupKeyManager', 'GroupKeyHandler',
 
+    'KeyQueryTracker',
+    'GroupMembership', 'GroupMembershipCache',
+    'OutboundScheduler',
     'GroupMessageDistributor',
     'GroupMessageHandler',
     'ForwardContentProcessor',
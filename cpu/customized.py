@@ -36,6 +36,8 @@ from libs.common import GroupKeys
 from libs.database import Database
 from libs.client import ClientMessenger
 
+from .tracker import KeyQueryTracker
+
 
 @Singleton
 class GroupKeyManager:
@@ -55,33 +57,15 @@ class GroupKeyManager:
     async def save_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> bool:
         db = self.database
         assert db is not None, 'database not set yet'
-        #
-        #  1. get old keys
-        #
-        old_keys = await db.get_group_keys(group=group, sender=sender)
-        if old_keys is not None:
-            digest = old_keys.get('digest')
-            if digest is not None and digest == keys.get('digest'):
-                #
-                #  2. digest matched, merge keys
-                #
-                cnt = 0
-                for k in keys:
-                    if k == 'digest':
-                        continue
-                    else:
-                        cnt += 1
-                    old_keys[k] = keys[k]
-                if cnt == 0:
-                    # nothing changed
-                    return False
-                # update new keys
-                keys = old_keys
-        #
-        #  3. save new keys
-        #
+        # the database will merge new keys with the old records (if digest matched)
         return await db.save_group_keys(group=group, sender=sender, keys=keys)
 
+    async def update_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """ Save new keys and return the newest table """
+        db = self.database
+        assert db is not None, 'database not set yet'
+        return await db.update_group_keys(group=group, sender=sender, keys=keys)
+
     async def load_group_keys(self, group: ID, sender: ID) -> Optional[Dict[str, str]]:
         db = self.database
         assert db is not None, 'database not set yet'
@@ -137,6 +121,8 @@ class GroupKeyHandler(BaseCustomizedContentHandler):
             text = 'Group keys error, failed to update.'
         elif await db.save_group_keys(group=group, sender=sender, keys=keys):
             text = 'Group keys updated.'
+            # replay messages waiting for these keys
+            KeyQueryTracker().keys_updated(group=group, sender=sender)
         else:
             text = 'Failed to update group keys.'
         # respond
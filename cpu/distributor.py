@@ -23,8 +23,10 @@
 # SOFTWARE.
 # ==============================================================================
 
+import heapq
 import threading
-from typing import Optional, Set, List, Dict
+from collections import deque
+from typing import Optional, Set, List, Deque, Tuple, Dict
 
 from dimples import ID, ReliableMessage
 from dimples import ForwardContent
@@ -36,18 +38,39 @@ from libs.utils import Logging
 from libs.database import Database
 from libs.client import Footprint
 
+from .scheduler import OutboundScheduler
+
 
 @Singleton
 class GroupMessageDistributor(Runner, Logging):
 
+    # limits for packing messages into one forward content
+    BATCH_COUNT = 32
+    BATCH_SIZE = 1024 * 64  # bytes
+
+    # stored messages loaded for each page, sending is paced by the outbound scheduler
+    PAGE_SIZE = 128
+
+    # limits for messages waiting in memory, the overflow will be spilled to the inbox
+    QUEUE_LIMIT = 256  # messages for each receiver
+    QUEUE_MEMORY = 1024 * 1024 * 16  # bytes for all receivers
+
     def __init__(self):
         super().__init__(interval=Runner.INTERVAL_SLOW)
         self.__db: Optional[Database] = None
         self.__messenger: Optional[CommonMessenger] = None
+        self.__batch_count = self.BATCH_COUNT
+        self.__batch_size = self.BATCH_SIZE
+        self.__page_size = self.PAGE_SIZE
         # waiting queue
-        self.__message_cache: Dict[ID, List[ReliableMessage]] = {}
+        self.__message_cache: Dict[ID, Deque[ReliableMessage]] = {}
+        self.__cache_bytes = 0
+        self.__queue_limit = self.QUEUE_LIMIT
+        self.__queue_memory = self.QUEUE_MEMORY
         self.__members: Set[ID] = set()
-        self.__lock = threading.Lock()
+        self.__lock = threading.Lock()  # for memory cache only, never held across awaits
+        self.__delivery_stats = {'delivered': 0, 'trimmed': 0, 'failed': 0}
+        self.__queue_stats = {'overflow': 0, 'over_budget': 0, 'spilled': 0, 'kept': 0, 'dropped': 0}
         # auto start
         self.start()
 
@@ -67,33 +90,215 @@ class GroupMessageDistributor(Runner, Logging):
     def messenger(self, transceiver: CommonMessenger):
         self.__messenger = transceiver
 
+    @property
+    def batch_count(self) -> int:
+        """ max count of messages in one forward content, 1 means no batching """
+        return self.__batch_count
+
+    @batch_count.setter
+    def batch_count(self, count: int):
+        assert count > 0, 'batch count error: %d' % count
+        self.__batch_count = count
+
+    @property
+    def batch_size(self) -> int:
+        """ max bytes of messages in one forward content """
+        return self.__batch_size
+
+    @batch_size.setter
+    def batch_size(self, size: int):
+        assert size > 0, 'batch size error: %d' % size
+        self.__batch_size = size
+
+    @property
+    def page_size(self) -> int:
+        """ max count of stored messages loaded at once """
+        return self.__page_size
+
+    @page_size.setter
+    def page_size(self, size: int):
+        assert size > 0, 'page size error: %d' % size
+        self.__page_size = size
+
+    @property
+    def queue_limit(self) -> int:
+        """ max count of messages waiting in memory for each receiver """
+        return self.__queue_limit
+
+    @queue_limit.setter
+    def queue_limit(self, count: int):
+        assert count > 0, 'queue limit error: %d' % count
+        self.__queue_limit = count
+
+    @property
+    def queue_memory(self) -> int:
+        """ max bytes of messages waiting in memory for all receivers """
+        return self.__queue_memory
+
+    @queue_memory.setter
+    def queue_memory(self, size: int):
+        assert size > 0, 'queue memory error: %d' % size
+        self.__queue_memory = size
+
+    @property
+    def queue_stats(self) -> Dict[str, int]:
+        """
+        receivers, messages & bytes waiting in memory;
+        overflow: times of receiver queue full; over_budget: times of memory budget exceeded;
+        spilled: messages moved out for the inbox;
+        kept/dropped: messages put back into memory (while room left) or lost, as failed to store
+        """
+        with self.__lock:
+            info = self.__queue_stats.copy()
+            info['receivers'] = len(self.__message_cache)
+            info['messages'] = sum([len(queue) for queue in self.__message_cache.values()])
+            info['bytes'] = self.__cache_bytes
+            return info
+
     async def cache_message(self, msg: ReliableMessage, receiver: ID):
+        return await self.cache_messages(messages={receiver: msg})
+
+    async def cache_messages(self, messages: Dict[ID, ReliableMessage]):
+        """ Cache messages split for group members: receiver => message """
         fp = Footprint()
+        active, vanished = await fp.partition_vanished(identifiers=messages.keys())
+        # waiting for online receivers, the overflow will be stored as vanished
+        spilled = self._enqueue_messages(messages=messages, receivers=active)
+        # store messages for vanished receivers
+        if len(vanished) > 0:
+            self.info(msg='store messages for %d vanished receiver(s)' % len(vanished))
+            stored = spilled + [(messages[receiver], receiver) for receiver in vanished]
+        else:
+            stored = spilled
+        return await self._store_messages(messages=stored, spilled=spilled)
+
+    async def _store_messages(self, messages: List[Tuple[ReliableMessage, ID]],
+                              spilled: List[Tuple[ReliableMessage, ID]]) -> bool:
+        """ Store messages into the inbox, if failed, keep the spilled ones in memory while room left """
+        if len(messages) == 0:
+            return True
         db = self.database
+        if await db.inbox_cache_reliable_messages(messages=messages):
+            return True
+        # redis not configured or not reachable
+        kept = self._keep_messages(messages=spilled)
+        dropped = len(messages) - kept
         with self.__lock:
-            if await fp.is_vanished(identifier=receiver):
-                self.info(msg='store message for vanished receiver: %s' % receiver)
-                await db.inbox_cache_reliable_message(msg=msg, receiver=receiver)
-            else:
-                messages = self.__message_cache.get(receiver)
-                if messages is None:
-                    messages = []
-                    self.__message_cache[receiver] = messages
-                messages.append(msg)
-                self.__members.add(receiver)
-        return True
+            self.__queue_stats['dropped'] += dropped
+        self.warning(msg='failed to store %d message(s), kept: %d, dropped: %d' % (len(messages), kept, dropped))
+        return False
 
-    async def _get_messages(self, receiver: ID) -> List[ReliableMessage]:
-        db = self.database
+    def _enqueue_messages(self, messages: Dict[ID, ReliableMessage],
+                          receivers: List[ID]) -> List[Tuple[ReliableMessage, ID]]:
+        """ Append messages to the queues of receivers, return the spilled ones """
+        spilled = []
         with self.__lock:
-            messages = self.__message_cache.get(receiver)
-            stored = await db.inbox_reliable_messages(receiver=receiver)
-            if messages is None or len(messages) == 0:
-                return stored
-            elif len(stored) == 0:
-                return messages
+            for receiver in receivers:
+                queue = self.__message_cache.get(receiver)
+                if queue is None:
+                    queue = deque()
+                    self.__message_cache[receiver] = queue
+                msg = messages[receiver]
+                queue.append(msg)
+                self.__cache_bytes += _estimate_size(msg=msg)
+                self.__members.add(receiver)
+                # check queue limit for this receiver
+                self._spill_overflow(receiver=receiver, queue=queue, spilled=spilled)
+            # check memory budget for all receivers
+            self._spill_over_budget(spilled=spilled)
+            self.__queue_stats['spilled'] += len(spilled)
+        return spilled
+
+    def _spill_overflow(self, receiver: ID, queue: Deque[ReliableMessage], spilled: List[Tuple[ReliableMessage, ID]]):
+        """ Spill the oldest messages of the receiver's queue over limit (lock held by caller) """
+        if len(queue) <= self.__queue_limit:
+            return
+        self.__queue_stats['overflow'] += 1
+        while len(queue) > self.__queue_limit:
+            msg = queue.popleft()
+            self.__cache_bytes -= _estimate_size(msg=msg)
+            spilled.append((msg, receiver))
+
+    def _spill_over_budget(self, spilled: List[Tuple[ReliableMessage, ID]]):
+        """ Spill the oldest messages of the largest queues until memory within budget (lock held by caller) """
+        if self.__cache_bytes <= self.__queue_memory:
+            return
+        self.__queue_stats['over_budget'] += 1
+        cache = self.__message_cache
+        # queues ordered by length, the largest first
+        heap = [(-len(queue), index, receiver) for index, (receiver, queue) in enumerate(cache.items())]
+        heapq.heapify(heap)
+        while self.__cache_bytes > self.__queue_memory and len(heap) > 0:
+            _, index, receiver = heapq.heappop(heap)
+            queue = cache[receiver]
+            msg = queue.popleft()
+            self.__cache_bytes -= _estimate_size(msg=msg)
+            spilled.append((msg, receiver))
+            if len(queue) > 0:
+                heapq.heappush(heap, (-len(queue), index, receiver))
             else:
-                return messages + stored
+                cache.pop(receiver, None)
+
+    def _keep_messages(self, messages: List[Tuple[ReliableMessage, ID]]) -> int:
+        """ Put back spilled messages ahead of the queues while room left, return count of kept """
+        kept = 0
+        with self.__lock:
+            cache = self.__message_cache
+            # the newest first, the older ones will be dropped when no room left
+            for msg, receiver in reversed(messages):
+                size = _estimate_size(msg=msg)
+                if self.__cache_bytes + size > self.__queue_memory:
+                    continue
+                queue = cache.get(receiver)
+                if queue is None:
+                    queue = deque()
+                    cache[receiver] = queue
+                elif len(queue) >= self.__queue_limit:
+                    continue
+                queue.appendleft(msg)
+                self.__cache_bytes += size
+                kept += 1
+            self.__queue_stats['kept'] += kept
+        return kept
+
+    def _take_messages(self, receiver: ID) -> List[ReliableMessage]:
+        """ Take out messages waiting in memory for the receiver """
+        with self.__lock:
+            queue = self.__message_cache.pop(receiver, None)
+            if queue is None:
+                return []
+            for msg in queue:
+                self.__cache_bytes -= _estimate_size(msg=msg)
+        return list(queue)
+
+    def _restore_messages(self, receiver: ID, messages: List[ReliableMessage]) -> List[Tuple[ReliableMessage, ID]]:
+        """ Put back undelivered messages before the new arrivals, return the spilled ones """
+        spilled = []
+        with self.__lock:
+            queue = self.__message_cache.get(receiver)
+            if queue is None:
+                queue = deque()
+                self.__message_cache[receiver] = queue
+            queue.extendleft(reversed(messages))
+            for msg in messages:
+                self.__cache_bytes += _estimate_size(msg=msg)
+            self._spill_overflow(receiver=receiver, queue=queue, spilled=spilled)
+            self._spill_over_budget(spilled=spilled)
+            self.__queue_stats['spilled'] += len(spilled)
+        return spilled
+
+    @property
+    def delivery_stats(self) -> Dict[str, int]:
+        """ delivered: messages sent; trimmed: removed from inbox; failed: sending failed """
+        with self.__lock:
+            return self.__delivery_stats.copy()
+
+    def _record_delivery(self, delivered: int, trimmed: int, failed: int):
+        with self.__lock:
+            stats = self.__delivery_stats
+            stats['delivered'] += delivered
+            stats['trimmed'] += trimmed
+            stats['failed'] += failed
 
     def wakeup_user(self, identifier: ID):
         with self.__lock:
@@ -126,14 +331,78 @@ class GroupMessageDistributor(Runner, Logging):
     async def _check_users(self, recipients: Set[ID]):
         self.info(msg='checking message for users: %s' % recipients)
         fp = Footprint()
-        messenger = self.messenger
-        for receiver in recipients:
-            if await fp.is_vanished(identifier=receiver):
-                self.info(msg='user %s is vanished, ignore it' % receiver)
-                continue
-            messages = await self._get_messages(receiver=receiver)
-            self.info(msg='forward %d messages for receiver: %s' % (len(messages), receiver))
-            for msg in messages:
-                command = ForwardContent.create(messages=[msg])
-                await messenger.send_content(sender=None, receiver=receiver, content=command)
-            # TODO: load all messages?
+        active, vanished = await fp.partition_vanished(identifiers=recipients)
+        if len(vanished) > 0:
+            self.info(msg='users vanished, ignore them: %s' % vanished)
+        for receiver in active:
+            await self._deliver_messages(receiver=receiver)
+
+    async def _deliver_messages(self, receiver: ID):
+        """ Forward waiting & stored messages to the receiver, then trim the delivered ones """
+        db = self.database
+        # 1. messages stored in the inbox (older than the waiting ones), page by page
+        async for page in db.inbox_message_pages(receiver=receiver, page_size=self.page_size):
+            sent = await self._forward_messages(messages=page, receiver=receiver)
+            # remove delivered messages from the inbox
+            trimmed = page[:sent]
+            if len(trimmed) > 0:
+                await db.inbox_remove_reliable_messages(messages=trimmed, receiver=receiver)
+            self._record_delivery(delivered=sent, trimmed=len(trimmed), failed=len(page) - sent)
+            if sent < len(page):
+                # keep undelivered messages in the inbox
+                return
+        # 2. messages waiting in memory
+        waiting = self._take_messages(receiver=receiver)
+        if len(waiting) > 0:
+            sent = await self._forward_messages(messages=waiting, receiver=receiver)
+            self._record_delivery(delivered=sent, trimmed=0, failed=len(waiting) - sent)
+            if sent < len(waiting):
+                # keep undelivered messages waiting in memory, the overflow will be stored
+                spilled = self._restore_messages(receiver=receiver, messages=waiting[sent:])
+                await self._store_messages(messages=spilled, spilled=spilled)
+
+    async def _forward_messages(self, messages: List[ReliableMessage], receiver: ID) -> int:
+        """ Forward messages in batches, return count of messages sent """
+        scheduler = OutboundScheduler()
+        batches = self._pack_messages(messages=messages)
+        self.info(msg='forward %d messages in %d packet(s) for receiver: %s'
+                      % (len(messages), len(batches), receiver))
+        sent = 0
+        for array in batches:
+            command = ForwardContent.create(messages=array)
+            ok = await scheduler.send_content(content=command, receiver=receiver,
+                                              lane=OutboundScheduler.LANE_FORWARD)
+            if not ok:
+                self.error(msg='failed to forward %d messages to %s' % (len(array), receiver))
+                break
+            sent += len(array)
+        return sent
+
+    def _pack_messages(self, messages: List[ReliableMessage]) -> List[List[ReliableMessage]]:
+        """ Split messages into batches limited by count & size """
+        max_count = self.batch_count
+        max_size = self.batch_size
+        batches = []
+        array = []
+        size = 0
+        for msg in messages:
+            length = _estimate_size(msg=msg)
+            if len(array) > 0 and (len(array) >= max_count or size + length > max_size):
+                batches.append(array)
+                array = []
+                size = 0
+            array.append(msg)
+            size += length
+        if len(array) > 0:
+            batches.append(array)
+        return batches
+
+
+def _estimate_size(msg: ReliableMessage) -> int:
+    """ Approximate length of the message in JSON """
+    size = 256  # envelope & others
+    for name in ['data', 'key', 'signature']:
+        value = msg.get(name)
+        if isinstance(value, str):
+            size += len(value)
+    return size
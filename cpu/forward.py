@@ -23,6 +23,7 @@
 # SOFTWARE.
 # ==============================================================================
 
+import asyncio
 from typing import List
 
 from dimples import ReliableMessage
@@ -52,29 +53,57 @@ class ForwardContentProcessor(BaseContentProcessor):
         assert isinstance(transceiver, CommonMessenger), 'messenger error: %s' % transceiver
         return transceiver
 
+    # Max forwarded messages processing at the same time, 1 means one by one.
+    # NOTICE: DbTask holds a threading.Lock across 'await self._read_data()',
+    #         concurrency is safe only while aiou's FileHelper uses SyncAccess and redis is
+    #         synchronous, and then the coroutines hardly overlap; if AsyncAccess (aiofiles)
+    #         is enabled, two secrets missing the same table cache would deadlock the loop.
+    CONCURRENCY = 1
+
     # Override
     async def process_content(self, content: Content, r_msg: ReliableMessage) -> List[Content]:
         assert isinstance(content, ForwardContent), 'forward content error: %s' % content
         secrets = content.secrets
-        messenger = self.messenger
         handler = GroupMessageHandler()
-        responses = []
-        for item in secrets:
+        results: List[List[ReliableMessage]] = [[] for _ in secrets]
+        direct: List[int] = []
+        for index, item in enumerate(secrets):
             receiver = item.receiver
             group = item.group
             if receiver.is_group:
                 # group message
                 assert not receiver.is_broadcast, 'message error: %s => %s' % (item.sender, receiver)
-                handler.append_message(msg=item)
-                results = []
             elif receiver.is_broadcast and group is not None:
                 # group command
                 assert not group.is_broadcast, 'message error: %s => %s (%s)' % (item.sender, receiver, group)
-                handler.append_message(msg=item)
-                results = []
             else:
-                results = await messenger.process_reliable_message(msg=item)
-            # NOTICE: append one result for each forwarded message.
-            res = ForwardContent.create(messages=results)
-            responses.append(res)
-        return responses
+                direct.append(index)
+                continue
+            # messages before this one (e.g.: group keys) must be processed first
+            await self._process_secrets(secrets=secrets, indexes=direct, results=results)
+            direct = []
+            handler.append_message(msg=item)
+        await self._process_secrets(secrets=secrets, indexes=direct, results=results)
+        # NOTICE: append one result for each forwarded message.
+        return [ForwardContent.create(messages=messages) for messages in results]
+
+    async def _process_secrets(self, secrets: List[ReliableMessage], indexes: List[int],
+                               results: List[List[ReliableMessage]]):
+        """ Process messages with indexes concurrently, results are put in the same positions """
+        if len(indexes) == 0:
+            return
+        elif len(indexes) == 1 or self.CONCURRENCY == 1:
+            for index in indexes:
+                results[index] = await self.messenger.process_reliable_message(msg=secrets[index])
+            return
+        semaphore = asyncio.Semaphore(self.CONCURRENCY)
+        tasks = [self._process_secret(msg=secrets[index], semaphore=semaphore) for index in indexes]
+        outputs = await asyncio.gather(*tasks, return_exceptions=True)
+        for index, output in zip(indexes, outputs):
+            if isinstance(output, BaseException):
+                raise output
+            results[index] = output
+
+    async def _process_secret(self, msg: ReliableMessage, semaphore: asyncio.Semaphore) -> List[ReliableMessage]:
+        async with semaphore:
+            return await self.messenger.process_reliable_message(msg=msg)
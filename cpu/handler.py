@@ -24,33 +24,46 @@
 # ==============================================================================
 
 import threading
-from typing import Optional, List, Dict
+from collections import deque
+from typing import Optional, Iterable, Tuple, List, Set, Dict, Deque
 
 from dimples import ID, ReliableMessage
 from dimples import Content
+from dimples import ReceiptCommand
 from dimples import CommonFacebook, CommonMessenger
 from dimples import BaseContentProcessor
 
 from libs.utils import Singleton
 from libs.utils import Runner
+from libs.utils import WaitingQueue
 from libs.utils import Logging
 from libs.common import GroupKeys
 from libs.client import Footprint
 
 from .customized import GroupKeyManager
 from .distributor import GroupMessageDistributor
+from .scheduler import OutboundScheduler
+from .tracker import KeyQueryTracker
+from .membership import GroupMembershipCache
 
 
 @Singleton
 class GroupMessageHandler(Runner, Logging):
 
+    WORKERS = 4  # default count of workers
+
     def __init__(self):
         super().__init__(interval=Runner.INTERVAL_SLOW)
         self.__facebook: Optional[CommonFacebook] = None
         self.__messenger: Optional[CommonMessenger] = None
         # message queue
-        self.__messages: List[ReliableMessage] = []
+        self.__queue: WaitingQueue[ReliableMessage] = WaitingQueue()
+        # (sender, group) => messages waiting for the worker who is processing the same pair
+        self.__sessions: Dict[Tuple[ID, ID], Deque[ReliableMessage]] = {}
         self.__lock = threading.Lock()
+        # workers
+        self.__workers = self.WORKERS
+        self.__threads: List[threading.Thread] = []
         # auto run
         self.start()
 
@@ -74,27 +87,54 @@ class GroupMessageHandler(Runner, Logging):
     def messenger(self, transceiver: CommonMessenger):
         self.__messenger = transceiver
 
-    async def _send_content(self, content: Content, receiver: ID, priority: int = 0):
-        messenger = self.messenger
-        i_msg, r_msg = await messenger.send_content(sender=None, receiver=receiver, content=content, priority=priority)
-        return r_msg is not None
+    # noinspection PyMethodMayBeStatic
+    def _send_receipt(self, receipt: ReceiptCommand, receiver: ID):
+        """ Receipts will be merged & sent later """
+        scheduler = OutboundScheduler()
+        scheduler.send_receipt(receipt=receipt, receiver=receiver)
+
+    # noinspection PyMethodMayBeStatic
+    async def _send_content(self, content: Content, receiver: ID, lane: int, priority: int = 0):
+        scheduler = OutboundScheduler()
+        return await scheduler.send_content(content=content, receiver=receiver, lane=lane, priority=priority)
 
     async def _fetch_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> Optional[Dict[str, str]]:
         db = self.database
         if keys is not None and len(keys) > 0:
-            await db.save_group_keys(group=group, sender=sender, keys=keys)
+            # merge and save, get newest keys
+            return await db.update_group_keys(group=group, sender=sender, keys=keys)
         # get newest keys
         return await db.load_group_keys(group=group, sender=sender)
 
     def append_message(self, msg: ReliableMessage):
         """ Add group message to waiting queue """
-        with self.__lock:
-            self.__messages.append(msg)
+        self.__queue.append(item=msg)
 
     def next_message(self) -> Optional[ReliableMessage]:
+        return self.__queue.pop()
+
+    async def wait_message(self, timeout: float) -> bool:
+        """ Wait until new message appended """
+        return await self.__queue.wait(timeout=timeout)
+
+    @property
+    def pending(self) -> int:
+        """ count of messages waiting in the queues """
         with self.__lock:
-            if len(self.__messages) > 0:
-                return self.__messages.pop(0)
+            count = self.__queue.size
+            for messages in self.__sessions.values():
+                count += len(messages)
+        return count
+
+    @property
+    def workers(self) -> int:
+        """ count of workers for splitting group messages """
+        return self.__workers
+
+    @workers.setter
+    def workers(self, count: int):
+        assert count > 0, 'workers count error: %d' % count
+        self.__workers = count
 
     def start(self):
         thr = Runner.async_thread(coro=self.run())
@@ -107,12 +147,50 @@ class GroupMessageHandler(Runner, Logging):
         if facebook is None or messenger is None:
             self.warning(msg='group message handler not ready yet')
             return False
-        msg = self.next_message()
-        if msg is None:
-            return False
-        else:
-            receiver = msg.receiver
-            group = msg.group
+        # clean stopped workers
+        threads = [thr for thr in self.__threads if thr.is_alive()]
+        # start more workers
+        index = len(threads)
+        while index < self.workers:
+            self.info(msg='starting group message worker: %d' % index)
+            worker = GroupMessageWorker(index=index, handler=self)
+            threads.append(worker.start())
+            index += 1
+        self.__threads = threads
+        # replay parked messages when group keys updated
+        return await self._replay_messages()
+
+    async def process_next(self) -> bool:
+        """ Take a message from the waiting queue and process it """
+        with self.__lock:
+            # pop & claim the session at once, so that no other worker
+            # can take a later message of the same session in between
+            msg = self.next_message()
+            if msg is None:
+                return False
+            key = _session_key(msg=msg)
+            waiting = self.__sessions.get(key)
+            if waiting is not None:
+                # another worker is processing messages from the same sender
+                # to the same group, let it take this one to keep the order
+                waiting.append(msg)
+                return True
+            waiting = deque()
+            self.__sessions[key] = waiting
+        while msg is not None:
+            await self._process_message(msg=msg)
+            with self.__lock:
+                if len(waiting) > 0:
+                    msg = waiting.popleft()
+                else:
+                    # all messages for this pair done
+                    self.__sessions.pop(key, None)
+                    msg = None
+        return True
+
+    async def _process_message(self, msg: ReliableMessage) -> bool:
+        receiver = msg.receiver
+        group = msg.group
         try:
             # the handler has taken over this message
             # so touch the sender here
@@ -150,52 +228,38 @@ class GroupMessageHandler(Runner, Logging):
         #
         #  0. check permission
         #
-        all_members = await self.facebook.get_members(identifier=group)
+        membership = await GroupMembershipCache().get_membership(group=group, facebook=self.facebook)
         # TODO: check owner, administrators
-        if sender not in all_members:
+        if not membership.is_member(sender):
             text = 'Permission denied.'
             receipt = BaseContentProcessor.create_receipt(text=text, envelope=msg.envelope, content=None, extra=None)
             receipt.group = group
-            await self._send_content(content=receipt, receiver=sender, priority=1)
+            self._send_receipt(receipt=receipt, receiver=sender)
             return False
         else:
-            other_members = set(all_members)
-            other_members.discard(sender)
+            other_members = membership.recipients(sender=sender)
         #
         #  1. split for other members
         #
         distributor = GroupMessageDistributor()
-        group_str = str(group)
-        missed = set()
-        for member in other_members:
-            # get encrypt key with target receiver
-            target = str(member)
-            enc_key = encrypted_keys.get(target)
-            if enc_key is None:
-                missed.add(member)
-                continue
-            else:
-                self.info(msg='split group message: %s => %s (%s)' % (sender, member, group))
-            # forward message
-            info = msg.copy_dict()
-            info.pop('keys', None)
-            info['key'] = enc_key
-            info['receiver'] = target
-            info['group'] = group_str
-            # content = ForwardContent.create()
-            # content['forward'] = info
-            # await self._send_content(content=content, receiver=member)
-            r_msg = ReliableMessage.parse(msg=info)
-            assert r_msg is not None, 'message error: %s' % info
-            await distributor.cache_message(msg=r_msg, receiver=member)
+        forks, missed = self._fork_messages(msg=msg, group=group, members=other_members, keys=encrypted_keys)
+        if len(forks) > 0:
+            await distributor.cache_messages(messages=forks)
         #
         #  2. query missed keys
         #
         key_digest = encrypted_keys.get('digest')
         if key_digest is not None and len(missed) > 0:
-            self.warning(msg='query missed group keys: %s => %s, %s' % (sender, group, missed))
-            query = GroupKeys.query_group_keys(group=group, sender=sender, digest=key_digest, members=list(missed))
-            await self._send_content(content=query, receiver=sender, priority=1)
+            # park the message for missed members until their keys updated
+            tracker = KeyQueryTracker()
+            tracker.park(group=group, sender=sender, digest=key_digest, msg=msg, missed=missed)
+            members = tracker.check_query(group=group, sender=sender, digest=key_digest, missed=missed)
+            if len(members) > 0:
+                self.warning(msg='query missed group keys: %s => %s, %s' % (sender, group, members))
+                query = GroupKeys.query_group_keys(group=group, sender=sender, digest=key_digest,
+                                                   members=list(members))
+                await self._send_content(content=query, receiver=sender,
+                                         lane=OutboundScheduler.LANE_KEY_QUERY, priority=1)
         #
         #  3. respond receipt
         #
@@ -208,7 +272,56 @@ class GroupMessageHandler(Runner, Logging):
             }
         })
         receipt.group = group
-        await self._send_content(content=receipt, receiver=sender, priority=1)
+        self._send_receipt(receipt=receipt, receiver=sender)
+        return True
+
+    def _fork_messages(self, msg: ReliableMessage, group: ID, members: Iterable[ID],
+                       keys: Dict[str, str]) -> Tuple[Dict[ID, ReliableMessage], Set[ID]]:
+        """ Split group message for members with keys, return forks & missed members """
+        sender = msg.sender
+        body = _message_body(msg=msg, group=group)
+        forks: Dict[ID, ReliableMessage] = {}
+        missed = set()
+        for member in members:
+            # get encrypt key with target receiver
+            target = str(member)
+            enc_key = keys.get(target)
+            if enc_key is None:
+                missed.add(member)
+                continue
+            else:
+                self.info(msg='split group message: %s => %s (%s)' % (sender, member, group))
+            # forward message
+            # content = ForwardContent.create()
+            # content['forward'] = info
+            # await self._send_content(content=content, receiver=member)
+            r_msg = _fork_message(body=body, receiver=target, key=enc_key)
+            assert r_msg is not None, 'message error: %s => %s' % (sender, target)
+            forks[member] = r_msg
+        return forks, missed
+
+    async def _replay_messages(self) -> bool:
+        """ Split parked messages for members whose keys were updated """
+        tracker = KeyQueryTracker()
+        ready = tracker.pop_ready()
+        if len(ready) == 0:
+            return False
+        distributor = GroupMessageDistributor()
+        for group, sender, digest, parked in ready:
+            encrypted_keys = await self.database.load_group_keys(group=group, sender=sender)
+            if encrypted_keys is None or encrypted_keys.get('digest') != digest:
+                # the sender has changed the keys, messages parked can never be decrypted
+                self.warning(msg='group keys changed, drop %d parked message(s): %s => %s'
+                                 % (len(parked), sender, group))
+                continue
+            for msg, members in parked:
+                forks, missed = self._fork_messages(msg=msg, group=group, members=members, keys=encrypted_keys)
+                if len(forks) > 0:
+                    self.info(msg='replay parked message: %s => %s, %d member(s)' % (sender, group, len(forks)))
+                    await distributor.cache_messages(messages=forks)
+                if len(missed) > 0:
+                    # still waiting for keys
+                    tracker.park(group=group, sender=sender, digest=digest, msg=msg, missed=missed)
         return True
 
     #
@@ -220,8 +333,68 @@ class GroupMessageHandler(Runner, Logging):
             self.error(msg='group error: %s' % group)
             return False
         messenger = self.messenger
-        responses = await messenger.process_reliable_message(msg=msg)
+        try:
+            responses = await messenger.process_reliable_message(msg=msg)
+        finally:
+            # members may be changed by this command
+            GroupMembershipCache().invalidate(group=group)
         for res in responses:
             await messenger.send_reliable_message(msg=res)
         # TODO: forward group command to other members?
         return True
+
+
+class GroupMessageWorker(Runner, Logging):
+    """
+        Worker for splitting group messages,
+        each one runs with its own event loop in a background thread.
+    """
+
+    def __init__(self, index: int, handler: GroupMessageHandler):
+        super().__init__(interval=Runner.INTERVAL_SLOW)
+        self.__index = index
+        self.__handler = handler
+
+    def start(self) -> threading.Thread:
+        thr = Runner.async_thread(coro=self.run())
+        thr.start()
+        return thr
+
+    # Override
+    async def process(self) -> bool:
+        handler = self.__handler
+        if self.__index >= handler.workers or not handler.running:
+            self.info(msg='group message worker stopped: %d' % self.__index)
+            await self.stop()
+            return False
+        return await handler.process_next()
+
+    # Override
+    async def _idle(self):
+        await self.__handler.wait_message(timeout=self.interval)
+
+
+def _message_body(msg: ReliableMessage, group: ID) -> Dict:
+    """ Body shared by all forked messages (data, signature, meta, visa, ...) """
+    info = msg.copy_dict()  # shallow copy
+    info.pop('keys', None)
+    info['group'] = str(group)
+    return info
+
+
+def _fork_message(body: Dict, receiver: str, key: str) -> Optional[ReliableMessage]:
+    """ Fork message for member, the values in body are shared, not copied """
+    info = body.copy()
+    info['key'] = key
+    info['receiver'] = receiver
+    return ReliableMessage.parse(msg=info)
+
+
+def _session_key(msg: ReliableMessage) -> Tuple[ID, ID]:
+    receiver = msg.receiver
+    group = msg.group
+    if receiver.is_group or group is None:
+        return msg.sender, receiver
+    else:
+        # group command
+        return msg.sender, group
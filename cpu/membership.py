@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MIT License
+#
+# Copyright (c) 2024 Albert Moky
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ==============================================================================
+"""
+    Group Membership Cache
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Frozen snapshots of group members, owner & administrators,
+    invalidated when group commands processed.
+"""
+
+import threading
+import time
+from typing import Optional, Tuple, List, Dict, FrozenSet
+
+from dimples import ID
+from dimples import CommonFacebook
+
+from libs.utils import Singleton
+from libs.utils import Runner
+
+
+class GroupMembership:
+    """ Snapshot of group members """
+
+    RECIPIENTS_LIMIT = 16  # max senders to keep the recipients for
+
+    def __init__(self, group: ID, owner: Optional[ID], members: List[ID], administrators: List[ID]):
+        super().__init__()
+        self.__group = group
+        self.__owner = owner
+        self.__members: FrozenSet[ID] = frozenset(members)
+        self.__administrators: FrozenSet[ID] = frozenset(administrators)
+        # sender => other members
+        self.__recipients: Dict[ID, FrozenSet[ID]] = {}
+
+    @property
+    def group(self) -> ID:
+        return self.__group
+
+    @property
+    def owner(self) -> Optional[ID]:
+        return self.__owner
+
+    @property
+    def members(self) -> FrozenSet[ID]:
+        return self.__members
+
+    @property
+    def administrators(self) -> FrozenSet[ID]:
+        return self.__administrators
+
+    def is_member(self, identifier: ID) -> bool:
+        return identifier in self.__members
+
+    def is_owner(self, identifier: ID) -> bool:
+        return identifier == self.__owner
+
+    def is_administrator(self, identifier: ID) -> bool:
+        return identifier in self.__administrators
+
+    def recipients(self, sender: ID) -> FrozenSet[ID]:
+        """ Members except the sender """
+        others = self.__recipients.get(sender)
+        if others is None:
+            others = self.__members.difference([sender])
+            if len(self.__recipients) >= self.RECIPIENTS_LIMIT:
+                self.__recipients.clear()
+            self.__recipients[sender] = others
+        return others
+
+
+@Singleton
+class GroupMembershipCache:
+
+    EXPIRES = 300  # seconds
+
+    def __init__(self):
+        super().__init__()
+        self.expires = self.EXPIRES
+        self.__lock = threading.Lock()
+        # group => (expired time, snapshot)
+        self.__snapshots: Dict[ID, Tuple[float, GroupMembership]] = {}
+        # group => generation, increased when invalidated
+        self.__generations: Dict[ID, int] = {}
+        # metrics
+        self.__hits = 0
+        self.__misses = 0
+        self.__invalidations = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                'groups': len(self.__snapshots),
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'invalidations': self.__invalidations,
+            }
+
+    async def get_membership(self, group: ID, facebook: CommonFacebook) -> GroupMembership:
+        """ Get snapshot from cache, or load from facebook """
+        now = time.time()
+        with self.__lock:
+            item = self.__snapshots.get(group)
+            if item is None or item[0] <= now:
+                snapshot = None
+                self.__misses += 1
+                generation = self.__generations.get(group, 0)
+            else:
+                snapshot = item[1]
+                self.__hits += 1
+        if snapshot is not None:
+            # let the checker query members when expired, as facebook.get_members() does
+            checker = facebook.checker
+            if checker is not None:
+                coro = checker.check_members(group=group, members=list(snapshot.members))
+                Runner.async_task(coro=coro)
+            return snapshot
+        # load from facebook
+        members = await facebook.get_members(identifier=group)
+        owner = await facebook.get_owner(identifier=group)
+        administrators = await facebook.get_administrators(group=group)
+        snapshot = GroupMembership(group=group, owner=owner, members=members, administrators=administrators)
+        if len(members) == 0 or members == [owner]:
+            # members not loaded yet (facebook returns the owner only and starts querying),
+            # load again next time
+            return snapshot
+        with self.__lock:
+            if self.__generations.get(group, 0) == generation:
+                # not invalidated while loading
+                self.__snapshots[group] = (now + self.expires, snapshot)
+        return snapshot
+
+    def invalidate(self, group: ID):
+        """ Remove snapshot for group, called when members or administrators saved """
+        with self.__lock:
+            self.__snapshots.pop(group, None)
+            self.__generations[group] = self.__generations.get(group, 0) + 1
+            self.__invalidations += 1
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MIT License
+#
+# Copyright (c) 2024 Albert Moky
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ==============================================================================
+
+"""
+    Receipt Aggregator
+    ~~~~~~~~~~~~~~~~~~
+
+    Receipts with the same text for the same sender & group within a short window
+    will be merged into one content; receipts with different texts (e.g.: rejections)
+    are never merged, so older clients still see each text.
+"""
+
+import threading
+import time
+from typing import Optional, Tuple, List, Dict
+
+from dimples import ID
+from dimples import Content
+from dimples import ReceiptCommand
+
+
+class ReceiptAggregator:
+
+    WINDOW = 0.5  # seconds
+
+    def __init__(self, window: float = None):
+        super().__init__()
+        if window is None:
+            window = self.WINDOW
+        self.window = window
+        self.__lock = threading.Lock()
+        # (receiver, group, text) => (deadline, receipts)
+        self.__pending: Dict[Tuple[ID, Optional[ID], Optional[str]], Tuple[float, List[ReceiptCommand]]] = {}
+        # metrics
+        self.__received = 0
+        self.__merged = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """ received: receipts appended; merged: receipts saved by merging """
+        with self.__lock:
+            return {
+                'pending': len(self.__pending),
+                'received': self.__received,
+                'merged': self.__merged,
+            }
+
+    def append(self, receipt: ReceiptCommand, receiver: ID):
+        """ Add receipt to be sent after window """
+        key = (receiver, receipt.group, receipt.text)
+        with self.__lock:
+            self.__received += 1
+            item = self.__pending.get(key)
+            if item is None:
+                self.__pending[key] = (time.time() + self.window, [receipt])
+            else:
+                item[1].append(receipt)
+
+    def pop_ready(self, now: float = None) -> List[Tuple[Content, ID]]:
+        """ Get merged receipts which window passed: [(content, receiver)] """
+        if now is None:
+            now = time.time()
+        with self.__lock:
+            ready = [key for key, item in self.__pending.items() if item[0] <= now]
+            results = []
+            for key in ready:
+                _, receipts = self.__pending.pop(key)
+                self.__merged += len(receipts) - 1
+                results.append((merge_receipts(receipts=receipts), key[0]))
+            return results
+
+
+def merge_receipts(receipts: List[ReceiptCommand]) -> Content:
+    """ Last receipt with all receipts listed in 'receipts' """
+    last = receipts[-1]
+    if len(receipts) == 1:
+        return last
+    res = Content.parse(content=last.copy_dict())
+    res['count'] = len(receipts)
+    res['receipts'] = [_receipt_info(receipt=item) for item in receipts]
+    return res
+
+
+def _receipt_info(receipt: ReceiptCommand) -> Dict:
+    info = {}
+    for name in ['text', 'origin', 'group', 'template', 'replacements']:
+        value = receipt.get(name)
+        if value is not None:
+            info[name] = value
+    return info
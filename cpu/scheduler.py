@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MIT License
+#
+# Copyright (c) 2024 Albert Moky
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ==============================================================================
+
+"""
+    Outbound Scheduler
+    ~~~~~~~~~~~~~~~~~~
+
+    All contents sent by the group bot go through here:
+        1. lanes for receipts, key queries & forwards, served by weights;
+        2. receivers in the same lane are served in turn;
+        3. sending is paced by a token bucket;
+        4. receipts for the same sender & group are merged within a window.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional, List, Deque, Dict, Any
+
+from dimples import ID
+from dimples import Content
+from dimples import ReceiptCommand
+from dimples import CommonMessenger
+
+from libs.utils import Singleton
+from libs.utils import Runner
+from libs.utils import WaitingQueue
+from libs.utils import Logging
+
+from .receipt import ReceiptAggregator
+
+
+class _Job:
+
+    def __init__(self, content: Content, receiver: ID, lane: int, priority: int):
+        super().__init__()
+        self.content = content
+        self.receiver = receiver
+        self.lane = lane
+        self.priority = priority
+        self.future = Future()
+
+
+class _Lane:
+    """ Jobs waiting in one lane, receivers served in turn """
+
+    def __init__(self, weight: int):
+        super().__init__()
+        self.weight = weight
+        self.credit = weight
+        self.__queues: Dict[ID, Deque[_Job]] = {}
+        self.__order: Deque[ID] = deque()
+        self.__size = 0
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def push(self, job: _Job):
+        queue = self.__queues.get(job.receiver)
+        if queue is None:
+            queue = deque()
+            self.__queues[job.receiver] = queue
+            self.__order.append(job.receiver)
+        queue.append(job)
+        self.__size += 1
+
+    def pop(self) -> Optional[_Job]:
+        if self.__size == 0:
+            return None
+        receiver = self.__order.popleft()
+        queue = self.__queues[receiver]
+        job = queue.popleft()
+        if len(queue) > 0:
+            # other jobs for this receiver, wait for next turn
+            self.__order.append(receiver)
+        else:
+            self.__queues.pop(receiver, None)
+        self.__size -= 1
+        return job
+
+
+class _TokenBucket:
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__last = time.monotonic()
+
+    def take(self) -> float:
+        """ Take one token, return seconds to wait before it's ready """
+        now = time.monotonic()
+        tokens = self.__tokens + (now - self.__last) * self.rate
+        self.__last = now
+        self.__tokens = min(tokens, float(self.burst)) - 1
+        if self.__tokens >= 0:
+            return 0
+        return -self.__tokens / self.rate
+
+
+@Singleton
+class OutboundScheduler(Runner, Logging):
+
+    LANE_RECEIPT = 0
+    LANE_KEY_QUERY = 1
+    LANE_FORWARD = 2
+
+    # jobs served for each lane in one round
+    LANE_WEIGHTS = [4, 2, 1]
+
+    # token bucket for sending to the station
+    RATE = 200   # contents per second
+    BURST = 100  # contents
+
+    def __init__(self):
+        super().__init__(interval=Runner.INTERVAL_SLOW)
+        self.__messenger: Optional[CommonMessenger] = None
+        # jobs from other threads
+        self.__incoming: WaitingQueue[_Job] = WaitingQueue()
+        # lanes are touched by the scheduler thread only
+        self.__lanes: List[_Lane] = [_Lane(weight=weight) for weight in self.LANE_WEIGHTS]
+        self.__bucket = _TokenBucket(rate=self.RATE, burst=self.BURST)
+        self.__receipts = ReceiptAggregator()
+        # metrics
+        self.__stats_lock = threading.Lock()
+        self.__sent = [0] * len(self.__lanes)
+        self.__failed = [0] * len(self.__lanes)
+        self.__throttled = 0.0
+        # auto start
+        self.start()
+
+    @property
+    def messenger(self) -> Optional[CommonMessenger]:
+        return self.__messenger
+
+    @messenger.setter
+    def messenger(self, transceiver: CommonMessenger):
+        self.__messenger = transceiver
+
+    @property
+    def rate(self) -> float:
+        """ max contents sent per second """
+        return self.__bucket.rate
+
+    @rate.setter
+    def rate(self, value: float):
+        assert value > 0, 'send rate error: %s' % value
+        self.__bucket.rate = value
+
+    @property
+    def burst(self) -> int:
+        """ max contents sent at once """
+        return self.__bucket.burst
+
+    @burst.setter
+    def burst(self, value: int):
+        assert value > 0, 'send burst error: %s' % value
+        self.__bucket.burst = value
+
+    @property
+    def receipt_window(self) -> float:
+        """ seconds for merging receipts """
+        return self.__receipts.window
+
+    @receipt_window.setter
+    def receipt_window(self, seconds: float):
+        assert seconds >= 0, 'receipt window error: %s' % seconds
+        self.__receipts.window = seconds
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """ queued, sent & failed for each lane (receipt, key query, forward); throttled seconds; receipts """
+        with self.__stats_lock:
+            return {
+                'queued': [lane.size for lane in self.__lanes],
+                'incoming': self.__incoming.size,
+                'sent': list(self.__sent),
+                'failed': list(self.__failed),
+                'throttled': self.__throttled,
+                'receipts': self.__receipts.stats,
+            }
+
+    def send_receipt(self, receipt: ReceiptCommand, receiver: ID):
+        """ Schedule a receipt to be merged with others for the same receiver & group """
+        self.__receipts.append(receipt=receipt, receiver=receiver)
+
+    async def send_content(self, content: Content, receiver: ID, lane: int, priority: int = 0) -> bool:
+        """
+        Schedule a content to be sent by the messenger,
+        callable from any thread.
+
+        :param content:  content to be sent
+        :param receiver: receiver ID
+        :param lane:     LANE_RECEIPT, LANE_KEY_QUERY or LANE_FORWARD
+        :param priority: priority for the messenger
+        :return: False on failed
+        """
+        assert 0 <= lane < len(self.LANE_WEIGHTS), 'lane error: %d' % lane
+        job = _Job(content=content, receiver=receiver, lane=lane, priority=priority)
+        self.__incoming.append(item=job)
+        return await asyncio.wrap_future(job.future)
+
+    def start(self):
+        thr = Runner.async_thread(coro=self.run())
+        thr.start()
+
+    def _next_job(self) -> Optional[_Job]:
+        # 1. move incoming jobs into lanes
+        while True:
+            job = self.__incoming.pop()
+            if job is None:
+                break
+            self.__lanes[job.lane].push(job=job)
+        # 2. move merged receipts into lane
+        lane = self.__lanes[self.LANE_RECEIPT]
+        for content, receiver in self.__receipts.pop_ready():
+            lane.push(job=_Job(content=content, receiver=receiver, lane=self.LANE_RECEIPT, priority=1))
+        # 3. pick a lane by weights
+        waiting = [lane for lane in self.__lanes if lane.size > 0]
+        if len(waiting) == 0:
+            return None
+        for lane in waiting:
+            if lane.credit > 0:
+                lane.credit -= 1
+                return lane.pop()
+        # all waiting lanes used up their credits, start a new round
+        for lane in self.__lanes:
+            lane.credit = lane.weight
+        lane = waiting[0]
+        lane.credit -= 1
+        return lane.pop()
+
+    # Override
+    async def process(self) -> bool:
+        job = self._next_job()
+        if job is None:
+            return False
+        # pacing
+        delay = self.__bucket.take()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        ok = False
+        try:
+            messenger = self.messenger
+            if messenger is None:
+                self.error(msg='messenger not set, drop content for %s' % job.receiver)
+            else:
+                _, r_msg = await messenger.send_content(sender=None, receiver=job.receiver,
+                                                        content=job.content, priority=job.priority)
+                ok = r_msg is not None
+        except Exception as error:
+            self.error(msg='failed to send content to %s: %s' % (job.receiver, error))
+        with self.__stats_lock:
+            if ok:
+                self.__sent[job.lane] += 1
+            else:
+                self.__failed[job.lane] += 1
+            self.__throttled += delay
+        job.future.set_result(ok)
+        return True
+
+    # Override
+    async def _idle(self):
+        await self.__incoming.wait(timeout=self.interval)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MIT License
+#
+# Copyright (c) 2024 Albert Moky
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ==============================================================================
+"""
+    Group Key Query Tracker
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Missed-key queries to the same sender for the same digest will be sent
+    only once within a cooldown, and the group messages for the missed members
+    will be parked here until the sender updates the group keys.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Tuple, List, Set, Dict, Deque
+
+from dimples import ID
+from dimples import ReliableMessage
+
+from libs.utils import Singleton
+
+
+class _Query:
+
+    def __init__(self):
+        super().__init__()
+        # members queried within cooldown
+        self.members: Set[ID] = set()
+        self.next_time = 0
+        # (time, msg, missed members)
+        self.parked: Deque[Tuple[float, ReliableMessage, Set[ID]]] = deque()
+        # group keys updated, parked messages can be replayed
+        self.ready = False
+
+
+@Singleton
+class KeyQueryTracker:
+
+    COOLDOWN = 30        # seconds
+    PARK_LIMIT = 64      # max parked messages for each (group, sender, digest)
+    PARK_EXPIRES = 600   # seconds
+
+    def __init__(self):
+        super().__init__()
+        self.cooldown = self.COOLDOWN
+        self.park_limit = self.PARK_LIMIT
+        self.park_expires = self.PARK_EXPIRES
+        self.__lock = threading.Lock()
+        # (group, sender, digest) => query
+        self.__queries: Dict[Tuple[ID, ID, str], _Query] = {}
+        # metrics
+        self.__sent = 0
+        self.__suppressed = 0
+        self.__parked = 0
+        self.__dropped = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """ sent/suppressed: queries; parked/dropped: messages """
+        with self.__lock:
+            return {
+                'queries': len(self.__queries),
+                'sent': self.__sent,
+                'suppressed': self.__suppressed,
+                'parked': self.__parked,
+                'dropped': self.__dropped,
+            }
+
+    def check_query(self, group: ID, sender: ID, digest: str, missed: Set[ID], now: float = None) -> Set[ID]:
+        """
+        Get members need to query for group keys, empty means suppressed
+
+        :param group:  group ID
+        :param sender: group message sender
+        :param digest: group keys digest
+        :param missed: members without keys
+        :param now:    current time
+        :return: members not queried within cooldown
+        """
+        if now is None:
+            now = time.time()
+        key = (group, sender, digest)
+        with self.__lock:
+            query = self.__queries.get(key)
+            if query is None:
+                query = _Query()
+                self.__queries[key] = query
+            if query.next_time <= now:
+                # cooldown passed, query all missed members again
+                query.members = set(missed)
+                query.next_time = now + self.cooldown
+                members = set(missed)
+            else:
+                # query new members only, and merge them into the queried set
+                members = missed.difference(query.members)
+                query.members.update(members)
+            if len(members) > 0:
+                self.__sent += 1
+            else:
+                self.__suppressed += 1
+            return members
+
+    def park(self, group: ID, sender: ID, digest: str, msg: ReliableMessage, missed: Set[ID], now: float = None):
+        """ Keep group message for missed members until the keys updated """
+        if now is None:
+            now = time.time()
+        key = (group, sender, digest)
+        with self.__lock:
+            query = self.__queries.get(key)
+            if query is None:
+                query = _Query()
+                self.__queries[key] = query
+            parked = query.parked
+            self._expire(parked=parked, now=now)
+            while len(parked) >= self.park_limit:
+                parked.popleft()
+                self.__dropped += 1
+            parked.append((now, msg, set(missed)))
+            self.__parked += 1
+
+    def keys_updated(self, group: ID, sender: ID):
+        """ Mark parked messages from this sender to be replayed """
+        with self.__lock:
+            for key, query in self.__queries.items():
+                if key[0] == group and key[1] == sender:
+                    # members without keys should be queried again
+                    query.members.clear()
+                    query.next_time = 0
+                    query.ready = len(query.parked) > 0
+
+    def pop_ready(self, now: float = None) -> List[Tuple[ID, ID, str, List[Tuple[ReliableMessage, Set[ID]]]]]:
+        """ Get parked messages to be replayed: [(group, sender, digest, [(msg, missed)])] """
+        if now is None:
+            now = time.time()
+        results = []
+        with self.__lock:
+            for key in list(self.__queries.keys()):
+                query = self.__queries[key]
+                parked = query.parked
+                self._expire(parked=parked, now=now)
+                if query.ready:
+                    query.ready = False
+                    results.append((key[0], key[1], key[2], [(item[1], item[2]) for item in parked]))
+                    parked.clear()
+                elif len(parked) == 0 and query.next_time <= now:
+                    # nothing parked and cooldown passed
+                    self.__queries.pop(key)
+        return results
+
+    def _expire(self, parked: Deque[Tuple[float, ReliableMessage, Set[ID]]], now: float):
+        expired = now - self.park_expires
+        while len(parked) > 0 and parked[0][0] < expired:
+            parked.popleft()
+            self.__dropped += 1
@@ -23,30 +23,55 @@
 # SOFTWARE.
 # ==============================================================================
 
-from typing import Optional, List
+import heapq
+import threading
+import time
+from typing import Optional, Tuple, List, Dict, Set
+from typing import Iterable
 
 from dimples import DateTime
 from dimples import ID
 from dimples import CommonFacebook
 
 from ..utils import Singleton
+from ..utils import Runner
 from ..utils import Logging
 from ..common import ActiveUser
 from ..database import Database
 
 
 @Singleton
-class Footprint(Logging):
+class Footprint(Runner, Logging):
 
     FP_EXPIRES = 3600 * 72  # vanished after 3 days
     INTERVAL = 600          # save interval
+    COMPACT_INTERVAL = 600  # interval for checking visa times & expired users
 
     def __init__(self):
-        super().__init__()
+        super().__init__(interval=2.0)
         self.__facebook: Optional[CommonFacebook] = None
         self.__db: Optional[Database] = None
-        self.__active_users: Optional[List[ActiveUser]] = None
+        # ID => ActiveUser
+        self.__index: Optional[Dict[ID, ActiveUser]] = None
+        self.__sorted: Optional[List[ActiveUser]] = None  # ordered by time (newest first)
+        # min-heap of (timestamp, seq, ID), oldest first;
+        # entries are pushed again when touched, so the stale ones will be skipped
+        self.__heap: List[Tuple[float, int, ID]] = []
+        self.__seq = 0
+        self.__lock = threading.Lock()
         self.__next_time = DateTime.now()  # next time to save
+        # users changed since last flush
+        self.__dirty: Set[ID] = set()
+        self.__flush_stats = {
+            'flushes': 0,         # times of saving
+            'flushed': 0,         # changed users saved
+            'last_duration': 0.0,
+            'max_duration': 0.0,
+            'total_duration': 0.0,
+        }
+        self.__compact_time = DateTime.now() + self.COMPACT_INTERVAL
+        # auto start
+        self.start()
 
     @property
     def facebook(self) -> Optional[CommonFacebook]:
@@ -70,19 +95,83 @@ class Footprint(Logging):
         self.__next_time = DateTime(timestamp=next_time)
 
     # private
-    async def _save_users(self, users: List[ActiveUser], now: DateTime):
-        facebook = self.facebook
-        assert facebook is not None, 'facebook not set yet'
-        users = await _sort_users(users=users, facebook=facebook)
-        self.__active_users = users
-        if now < self.__next_time:
-            # self.info(msg='active users not saved now: %d' % len(users))
-            return False
-        # save to local storage
+    def _set_users(self, users: List[ActiveUser]):
+        """ rebuild index with users sorted by time """
+        index = {}
+        heap = []
+        seq = 0
+        for item in users:
+            index[item.identifier] = item
+            heap.append((item.timestamp, seq, item.identifier))
+            seq += 1
+        heapq.heapify(heap)
+        with self.__lock:
+            self.__index = index
+            self.__sorted = users
+            self.__heap = heap
+            self.__seq = seq
+
+    # private
+    def _push(self, item: ActiveUser):
+        """ reposition the touched user, call with lock """
+        self.__seq += 1
+        heapq.heappush(self.__heap, (item.timestamp, self.__seq, item.identifier))
+        self.__sorted = None
+        self.__dirty.add(item.identifier)
+
+    @property
+    def pending(self) -> int:
+        """ count of changed users waiting to save """
+        return len(self.__dirty)
+
+    @property
+    def flush_stats(self) -> Dict[str, float]:
+        """ metrics of saving active users """
+        with self.__lock:
+            info = self.__flush_stats.copy()
+            info['pending'] = len(self.__dirty)
+        return info
+
+    async def flush(self, now: DateTime = None) -> bool:
+        """ Save changed users into local storage """
+        if now is None:
+            now = DateTime.now()
+        with self.__lock:
+            dirty = self.__dirty
+            if len(dirty) == 0:
+                return False
+            self.__dirty = set()
         self._refresh_next_time(now=now)
-        db = self.database
-        assert db is not None, 'database not set yet'
-        return await db.save_active_users(users=users)
+        start = time.time()
+        ok = False
+        try:
+            index = await self._get_index(now=now)
+            changed = [index[uid] for uid in dirty if uid in index]
+            db = self.database
+            assert db is not None, 'database not set yet'
+            # try to save changed users only,
+            # users expired by compaction cannot be appended, rewrite the whole list for them
+            if 0 < len(changed) == len(dirty):
+                ok = await db.append_active_users(users=changed)
+            if not ok:
+                users = await self.active_users(now=now)
+                ok = await db.save_active_users(users=users)
+        finally:
+            if not ok:
+                # save them next time
+                with self.__lock:
+                    self.__dirty.update(dirty)
+        elapsed = time.time() - start
+        with self.__lock:
+            stats = self.__flush_stats
+            stats['flushes'] += 1
+            stats['flushed'] += len(dirty)
+            stats['last_duration'] = elapsed
+            stats['total_duration'] += elapsed
+            if elapsed > stats['max_duration']:
+                stats['max_duration'] = elapsed
+        self.info(msg='active users flushed: %d changed, %.3f seconds' % (len(dirty), elapsed))
+        return ok
 
     # private
     async def _load_users(self, now: DateTime) -> List[ActiveUser]:
@@ -92,21 +181,34 @@ class Footprint(Logging):
         assert db is not None, 'database not set yet'
         return await db.load_active_users()
 
-    async def active_users(self, now: DateTime = None) -> List[ActiveUser]:
-        users = self.__active_users
-        if users is None:
-            if now is None:
-                now = DateTime.now()
+    # private
+    async def _get_index(self, now: DateTime) -> Dict[ID, ActiveUser]:
+        index = self.__index
+        if index is None:
             users = await self._load_users(now=now)
-            self.__active_users = users
+            users = sorted(users, key=lambda x: x.timestamp, reverse=True)
+            self._set_users(users=users)
+            index = self.__index
+        return index
+
+    async def active_users(self, now: DateTime = None) -> List[ActiveUser]:
+        """ users ordered by last active time (newest first) """
+        if now is None:
+            now = DateTime.now()
+        index = await self._get_index(now=now)
+        with self.__lock:
+            users = self.__sorted
+            if users is None:
+                users = sorted(index.values(), key=lambda x: x.timestamp, reverse=True)
+                self.__sorted = users
         return users
 
     # private
     async def _last_time(self, identifier: ID, now: DateTime) -> Optional[DateTime]:
-        users = await self.active_users(now=now)
-        for item in users:
-            if item.identifier == identifier:
-                return item.time
+        index = await self._get_index(now=now)
+        item = index.get(identifier)
+        if item is not None:
+            return item.time
 
     # private
     async def _check_time(self, identifier: ID, when: Optional[DateTime]) -> Optional[DateTime]:
@@ -130,19 +232,21 @@ class Footprint(Logging):
             return False
         # check exist users
         now = DateTime.now()
-        users = await self.active_users(now=now)
-        found = False
-        for item in users:
-            if item.identifier == identifier:
-                # found, update time and sort
-                if not item.touch(when=when):
-                    self.info(msg='active user not touch: %s' % item)
-                found = True
-        if not found:
-            # insert new user
-            usr = ActiveUser(identifier=identifier, when=when)
-            users.insert(0, usr)
-        return await self._save_users(users=users, now=now)
+        index = await self._get_index(now=now)
+        with self.__lock:
+            item = index.get(identifier)
+            if item is None:
+                # insert new user
+                item = ActiveUser(identifier=identifier, when=when)
+                index[identifier] = item
+                self._push(item=item)
+            elif item.touch(when=when):
+                self._push(item=item)
+            else:
+                self.info(msg='active user not touch: %s' % item)
+                return False
+        # saved by background thread
+        return True
 
     async def is_vanished(self, identifier: ID, now: DateTime = None) -> bool:
         if now is None:
@@ -150,21 +254,100 @@ class Footprint(Logging):
         last = await self._last_time(identifier=identifier, now=now)
         return last is None or now > (last + self.FP_EXPIRES)
 
+    async def partition_vanished(self, identifiers: Iterable[ID],
+                                 now: DateTime = None) -> Tuple[List[ID], List[ID]]:
+        """
+        Check users in one pass
+
+        :param identifiers: user IDs
+        :param now:         current time
+        :return: (active users, vanished users)
+        """
+        if now is None:
+            now = DateTime.now()
+        index = await self._get_index(now=now)
+        expired = float(now) - self.FP_EXPIRES
+        active = []
+        vanished = []
+        for identifier in identifiers:
+            item = index.get(identifier)
+            if item is None or item.timestamp < expired:
+                vanished.append(identifier)
+            else:
+                active.append(identifier)
+        return active, vanished
+
+    #
+    #   Write-behind & Compaction
+    #
+
+    def start(self):
+        thr = Runner.async_thread(coro=self.run())
+        thr.start()
+
+    # Override
+    async def finish(self):
+        # save changes before stopped
+        await self.flush()
+        await super().finish()
 
-async def _sort_users(users: List[ActiveUser], facebook: CommonFacebook) -> List[ActiveUser]:
-    array = []
-    now = DateTime.now()
-    users = users.copy()
-    for item in users:
-        uid = item.identifier
-        visa = await facebook.get_visa(user=uid)
-        if visa is not None:
-            # update with visa time
+    # Override
+    async def process(self) -> bool:
+        now = DateTime.now()
+        if self.__index is None:
+            return False
+        if now >= self.__compact_time and self.facebook is not None:
+            self.__compact_time = DateTime(timestamp=now + self.COMPACT_INTERVAL)
+            try:
+                await self._compact(now=now)
+            except Exception as error:
+                self.error(msg='failed to compact active users: %s' % error)
+        if now >= self.__next_time and len(self.__dirty) > 0:
+            try:
+                await self.flush(now=now)
+            except Exception as error:
+                self.error(msg='failed to save active users: %s' % error)
+        return False
+
+    async def _compact(self, now: DateTime):
+        """ update times with visas, and remove users gone for a month """
+        facebook = self.facebook
+        index = self.__index
+        # 1. update with visa time
+        for item in list(index.values()):
+            visa = await facebook.get_visa(user=item.identifier)
+            if visa is None:
+                continue
             last_time = visa.time
-            if last_time is not None:
-                item.touch(when=last_time)
-        # check whether it is gone
-        if item.recently_active(now=now):
-            array.append(item)
-    array.sort(key=lambda x: x.time, reverse=True)
-    return array
+            if last_time is None:
+                continue
+            with self.__lock:
+                if item.touch(when=last_time):
+                    self._push(item=item)
+        # 2. remove users not active recently
+        expired = 0
+        with self.__lock:
+            heap = self.__heap
+            while len(heap) > 0:
+                timestamp, _, identifier = heap[0]
+                item = index.get(identifier)
+                if item is None or item.timestamp != timestamp:
+                    # stale entry
+                    heapq.heappop(heap)
+                elif item.recently_active(now=now):
+                    # the oldest one is still active
+                    break
+                else:
+                    heapq.heappop(heap)
+                    index.pop(identifier, None)
+                    self.__dirty.add(identifier)
+                    expired += 1
+            if expired > 0:
+                self.__sorted = None
+            # 3. drop stale entries
+            if len(heap) > len(index) * 2:
+                heap = [(item.timestamp, seq, uid) for seq, (uid, item) in enumerate(index.items())]
+                heapq.heapify(heap)
+                self.__heap = heap
+                self.__seq = len(heap)
+        self.info(msg='active users compacted: %d, expired: %d' % (len(index), expired))
@@ -34,10 +34,13 @@ class ActiveUser:
 
     MONTHLY = 3600 * 24 * 30
 
+    # no '__dict__' for each user, the time is kept as a float timestamp
+    __slots__ = ('__identifier', '__timestamp')
+
     def __init__(self, identifier: ID, when: DateTime):
         super().__init__()
         self.__identifier = identifier
-        self.__time = when
+        self.__timestamp = float(when)
 
     @property
     def identifier(self) -> ID:
@@ -45,18 +48,32 @@ class ActiveUser:
 
     @property
     def time(self) -> DateTime:
-        return self.__time
+        return DateTime(timestamp=self.__timestamp)
+
+    @property
+    def timestamp(self) -> float:
+        """ last active time, for sorting & filtering """
+        return self.__timestamp
 
     def touch(self, when: DateTime) -> bool:
         assert when is not None, 'active time should not empty'
-        if self.__time < when:
-            self.__time = when
+        timestamp = float(when)
+        if self.__timestamp < timestamp:
+            self.__timestamp = timestamp
             return True
         else:
             return False
 
     def recently_active(self, now: DateTime) -> bool:
-        return now < (self.__time + self.MONTHLY)
+        return float(now) < (self.__timestamp + self.MONTHLY)
+
+    # Override
+    def __str__(self) -> str:
+        return '<%s ID="%s" time="%s" />' % (self.__class__.__name__, self.__identifier, self.time)
+
+    # Override
+    def __repr__(self) -> str:
+        return self.__str__()
 
     #
     #   Factories
@@ -97,7 +114,7 @@ class ActiveUser:
                 info = {
                     'ID': str(item.identifier),
                     'did': str(item.identifier),
-                    'time': float(item.time),
+                    'time': item.timestamp,
                     'time_str': str(item.time),
                 }
             elif isinstance(item, Dict):
@@ -119,3 +136,13 @@ class ActiveUserDBI(ABC):
     @abstractmethod
     async def load_active_users(self) -> List[ActiveUser]:
         raise NotImplemented
+
+    @abstractmethod
+    async def append_active_users(self, users: List[ActiveUser]) -> bool:
+        """
+        Save changed users only
+
+        :param users: changed users
+        :return: False to save all users instead
+        """
+        raise NotImplemented
@@ -63,6 +63,8 @@ __all__ = [
     'StationStorage',
 
     'ActiveUserStorage',
+    'ActiveUserJournal',
+    'GroupKeysJournal',
 
     #
     #   Redis
@@ -75,6 +77,7 @@ __all__ = [
     # 'MessageCache', 'StationCache',
 
     'GroupInboxMessageCache',
+    'GroupKeysHashCache',
 
     #
     #   Database
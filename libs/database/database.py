@@ -29,7 +29,7 @@
 
 """
 
-from typing import Optional, Dict, List, Tuple
+from typing import AsyncIterator, Callable, Optional, Dict, List, Tuple
 
 from dimples import SymmetricKey, PrivateKey, SignKey, DecryptKey
 from dimples import ID, Meta, Document
@@ -70,6 +70,8 @@ class Database(AccountDBI, MessageDBI, SessionDBI):
         self.__inbox_table = GroupInboxMessageTable(config=config)
         # Active Users
         self.__active_users_table = ActiveUserTable(config=config)
+        # listeners for group members changed
+        self.__group_listeners: List[Callable[[ID], None]] = []
         # # ANS
         # self.__ans_table = AddressNameTable(info=info)
 
@@ -255,7 +257,10 @@ class Database(AccountDBI, MessageDBI, SessionDBI):
 
     # Override
     async def save_members(self, members: List[ID], group: ID) -> bool:
-        return await self.__group_table.save_members(members=members, group=group)
+        ok = await self.__group_table.save_members(members=members, group=group)
+        if ok:
+            self._group_changed(group=group)
+        return ok
 
     # Override
     async def get_administrators(self, group: ID) -> List[ID]:
@@ -263,7 +268,18 @@ class Database(AccountDBI, MessageDBI, SessionDBI):
 
     # Override
     async def save_administrators(self, administrators: List[ID], group: ID) -> bool:
-        return await self.__group_table.save_administrators(administrators=administrators, group=group)
+        ok = await self.__group_table.save_administrators(administrators=administrators, group=group)
+        if ok:
+            self._group_changed(group=group)
+        return ok
+
+    def add_group_listener(self, listener: Callable[[ID], None]):
+        """ Listener will be called with the group ID after members or administrators saved """
+        self.__group_listeners.append(listener)
+
+    def _group_changed(self, group: ID):
+        for listener in self.__group_listeners:
+            listener(group)
 
     #
     #   Group History DBI
@@ -323,12 +339,21 @@ class Database(AccountDBI, MessageDBI, SessionDBI):
     async def inbox_reliable_messages(self, receiver: ID, limit: int = 1024) -> List[ReliableMessage]:
         return await self.__inbox_table.get_reliable_messages(receiver=receiver, limit=limit)
 
+    def inbox_message_pages(self, receiver: ID, page_size: int = None) -> AsyncIterator[List[ReliableMessage]]:
+        return self.__inbox_table.message_pages(receiver=receiver, page_size=page_size)
+
     async def inbox_cache_reliable_message(self, msg: ReliableMessage, receiver: ID) -> bool:
         return await self.__inbox_table.cache_reliable_message(msg=msg, receiver=receiver)
 
+    async def inbox_cache_reliable_messages(self, messages: List[Tuple[ReliableMessage, ID]]) -> bool:
+        return await self.__inbox_table.cache_reliable_messages(messages=messages)
+
     async def inbox_remove_reliable_message(self, msg: ReliableMessage, receiver: ID) -> bool:
         return await self.__inbox_table.remove_reliable_message(msg=msg, receiver=receiver)
 
+    async def inbox_remove_reliable_messages(self, messages: List[ReliableMessage], receiver: ID) -> bool:
+        return await self.__inbox_table.remove_reliable_messages(messages=messages, receiver=receiver)
+
     """
         Message Keys
         ~~~~~~~~~~~~
@@ -352,6 +377,14 @@ class Database(AccountDBI, MessageDBI, SessionDBI):
     async def save_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> bool:
         return await self.__grp_keys_table.save_group_keys(group=group, sender=sender, keys=keys)
 
+    @property
+    def group_keys_stats(self) -> Dict[str, int]:
+        """ memory cache metrics of group keys """
+        return self.__grp_keys_table.cache_stats
+
+    async def update_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> Optional[Dict[str, str]]:
+        return await self.__grp_keys_table.update_group_keys(group=group, sender=sender, keys=keys)
+
     # """
     #     Address Name Service
     #     ~~~~~~~~~~~~~~~~~~~~
@@ -399,6 +432,9 @@ class Database(AccountDBI, MessageDBI, SessionDBI):
     async def load_active_users(self) -> List[ActiveUser]:
         return await self.__active_users_table.load_active_users()
 
+    async def append_active_users(self, users: List[ActiveUser]) -> bool:
+        return await self.__active_users_table.append_active_users(users=users)
+
     #
     #   Provider DBI
     #
@@ -32,6 +32,8 @@
 from dimples.database.dos import *
 
 from .active_users import ActiveUserStorage
+from .active_users import ActiveUserJournal
+from .group_keys import GroupKeysJournal
 
 
 __all__ = [
@@ -45,5 +47,7 @@ __all__ = [
     'StationStorage',
 
     'ActiveUserStorage',
+    'ActiveUserJournal',
+    'GroupKeysJournal',
 
 ]
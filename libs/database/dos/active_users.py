@@ -23,7 +23,10 @@
 # SOFTWARE.
 # ==============================================================================
 
-from typing import List
+from typing import Optional, List, Dict
+
+from dimples import DateTime
+from dimples import ID
 
 from dimples.database.dos import Storage
 
@@ -62,3 +65,102 @@ class ActiveUserStorage(Storage, ActiveUserDBI):
         path = self.__active_users_path()
         self.info('Saving %d active users into: %s' % (len(users), path))
         return await self.write_json(container=array, path=path)
+
+    # Override
+    async def append_active_users(self, users: List[ActiveUser]) -> bool:
+        # the whole file must be rewritten
+        return False
+
+
+class ActiveUserJournal(Storage, ActiveUserDBI):
+    """
+        Active Users Journal
+        ~~~~~~~~~~~~~~~~~~~~
+
+        file path: '.dim/protected/active_users.txt' (snapshot)
+        file path: '.dim/protected/active_users.log' (journal)
+
+        each line: '{TIMESTAMP} {ID}', the later time wins
+    """
+    snapshot_path = '{PROTECTED}/active_users.txt'
+    journal_path = '{PROTECTED}/active_users.log'
+
+    JOURNAL_MIN = 4096  # lines
+
+    def __init__(self, config):
+        super().__init__(config=config)
+        self.__snapshot_lines = 0
+        self.__journal_lines = 0
+
+    def show_info(self):
+        path = self.protected_path(self.snapshot_path)
+        print('!!!   active users path: %s' % path)
+        path = self.protected_path(self.journal_path)
+        print('!!! active users journal: %s' % path)
+
+    # Override
+    async def load_active_users(self) -> List[ActiveUser]:
+        # 1. load snapshot
+        path = self.protected_path(self.snapshot_path)
+        self.info('Loading active users from: %s' % path)
+        table = {}
+        self.__snapshot_lines = _parse_lines(text=await self.read_text(path=path), table=table)
+        # 2. replay journal
+        path = self.protected_path(self.journal_path)
+        self.info('Loading active users journal from: %s' % path)
+        self.__journal_lines = _parse_lines(text=await self.read_text(path=path), table=table)
+        return [ActiveUser(identifier=uid, when=DateTime(timestamp=when)) for uid, when in table.items()]
+
+    # Override
+    async def save_active_users(self, users: List[ActiveUser]) -> bool:
+        """ write snapshot & clear journal """
+        text = _build_lines(users=users)
+        path = self.protected_path(self.snapshot_path)
+        self.info('Saving %d active users into: %s' % (len(users), path))
+        if not await self.write_text(text=text, path=path):
+            return False
+        self.__snapshot_lines = len(users)
+        path = self.protected_path(self.journal_path)
+        if await self.write_text(text='', path=path):
+            self.__journal_lines = 0
+        return True
+
+    # Override
+    async def append_active_users(self, users: List[ActiveUser]) -> bool:
+        if self.__journal_lines + len(users) > max(self.JOURNAL_MIN, self.__snapshot_lines):
+            # journal too long, compact it
+            return False
+        text = _build_lines(users=users)
+        path = self.protected_path(self.journal_path)
+        self.info('Appending %d active users into: %s' % (len(users), path))
+        if await self.append_text(text=text, path=path):
+            self.__journal_lines += len(users)
+            return True
+        return False
+
+
+def _build_lines(users: List[ActiveUser]) -> str:
+    lines = ['%.3f %s\n' % (item.timestamp, item.identifier) for item in users]
+    return ''.join(lines)
+
+
+def _parse_lines(text: Optional[str], table: Dict[ID, float]) -> int:
+    if text is None:
+        return 0
+    count = 0
+    for line in text.splitlines():
+        pos = line.find(' ')
+        if pos < 0:
+            continue
+        try:
+            when = float(line[:pos])
+        except ValueError:
+            continue
+        identifier = ID.parse(identifier=line[pos+1:])
+        if identifier is None:
+            continue
+        count += 1
+        old = table.get(identifier)
+        if old is None or old < when:
+            table[identifier] = when
+    return count
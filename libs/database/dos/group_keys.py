@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MIT License
+#
+# Copyright (c) 2024 Albert Moky
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ==============================================================================
+
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict
+
+from dimples import ID
+
+from dimples.database.dos import GroupKeysStorage
+
+from ...utils import template_replace
+from ...utils import json_encode, json_decode
+
+
+class GroupKeysJournal(GroupKeysStorage):
+    """
+        Group Keys Journal
+        ~~~~~~~~~~~~~~~~~~
+
+        file path: '.dim/protected/{GROUP_ADDRESS}/{SENDER_ADDRESS}.keys.js' (snapshot)
+        file path: '.dim/protected/{GROUP_ADDRESS}/{SENDER_ADDRESS}.keys.log' (journal)
+
+        each line: JSON of changed entries, the later line wins
+    """
+    journal_path = '{PROTECTED}/{GROUP_ADDRESS}/{SENDER_ADDRESS}.keys.log'
+
+    JOURNAL_MAX = 64  # lines
+    JOURNAL_ENTRIES = 4096  # (group, sender) pairs to remember the journal lines for
+
+    def __init__(self, config):
+        super().__init__(config=config)
+        # (group, sender) => journal lines, the least recently used will be forgotten,
+        # and its journal will be rewritten with the snapshot next time
+        self.__journal_lines: OrderedDict[Tuple[ID, ID], int] = OrderedDict()
+
+    def show_info(self):
+        super().show_info()
+        path = self.protected_path(self.journal_path)
+        print('!!!  group keys journal: %s' % path)
+
+    def __journal_path(self, group: ID, sender: ID) -> str:
+        path = self.protected_path(self.journal_path)
+        path = template_replace(path, key='SENDER_ADDRESS', value=str(sender.address))
+        return template_replace(path, key='GROUP_ADDRESS', value=str(group.address))
+
+    # Override
+    async def get_group_keys(self, group: ID, sender: ID) -> Optional[Dict[str, str]]:
+        # 1. load snapshot
+        keys = await super().get_group_keys(group=group, sender=sender)
+        # 2. replay journal
+        path = self.__journal_path(group=group, sender=sender)
+        text = await self.read_text(path=path)
+        count = 0
+        if text is not None:
+            for line in text.splitlines():
+                try:
+                    changed = json_decode(string=line)
+                except ValueError:
+                    changed = None
+                if not isinstance(changed, Dict):
+                    continue
+                if keys is None:
+                    keys = {}
+                keys.update(changed)
+                count += 1
+        self._set_journal_lines(group=group, sender=sender, count=count)
+        return keys
+
+    # Override
+    async def save_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> bool:
+        """ write snapshot & clear journal """
+        if not await super().save_group_keys(group=group, sender=sender, keys=keys):
+            return False
+        if self._get_journal_lines(group=group, sender=sender) != 0:
+            path = self.__journal_path(group=group, sender=sender)
+            if not await self.write_text(text='', path=path):
+                return False
+        self._set_journal_lines(group=group, sender=sender, count=0)
+        return True
+
+    async def append_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> bool:
+        """ append changed entries, return False to save the whole table """
+        count = self._get_journal_lines(group=group, sender=sender)
+        if count is None or count >= self.JOURNAL_MAX:
+            # journal unknown or too long, rewrite snapshot
+            return False
+        text = '%s\n' % json_encode(container=keys)
+        path = self.__journal_path(group=group, sender=sender)
+        self.info(msg='Appending %d group keys into: %s' % (len(keys), path))
+        if await self.append_text(text=text, path=path):
+            self._set_journal_lines(group=group, sender=sender, count=count + 1)
+            return True
+        return False
+
+    def _get_journal_lines(self, group: ID, sender: ID) -> Optional[int]:
+        key = (group, sender)
+        count = self.__journal_lines.get(key)
+        if count is not None:
+            self.__journal_lines.move_to_end(key)
+        return count
+
+    def _set_journal_lines(self, group: ID, sender: ID, count: int):
+        key = (group, sender)
+        self.__journal_lines[key] = count
+        self.__journal_lines.move_to_end(key)
+        while len(self.__journal_lines) > self.JOURNAL_ENTRIES:
+            self.__journal_lines.popitem(last=False)
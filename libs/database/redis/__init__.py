@@ -32,6 +32,7 @@
 from dimples.database.redis import *
 
 from .group_inbox import GroupInboxMessageCache
+from .group_keys import GroupKeysHashCache
 
 
 __all__ = [
@@ -45,5 +46,6 @@ __all__ = [
     # 'StationCache',
 
     'GroupInboxMessageCache',
+    'GroupKeysHashCache',
 
 ]
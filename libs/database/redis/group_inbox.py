@@ -23,10 +23,16 @@
 # SOFTWARE.
 # ==============================================================================
 
-from typing import Optional
+from typing import Optional, Tuple, List
 
+from dimples import DateTime
+from dimples import ID
+from dimples import ReliableMessage
 from dimples.database.redis import MessageCache
 
+from ...utils import utf8_encode, utf8_decode, json_encode, json_decode
+from ...utils import get_msg_sig
+
 
 class GroupInboxMessageCache(MessageCache):
 
@@ -45,3 +51,76 @@ class GroupInboxMessageCache(MessageCache):
         redis key: 'dkd.msg_inbox.{ID}.{sig}'
         redis key: 'dkd.msg_inbox.{ID}.messages'
     """
+    def __msg_cache_name(self, identifier: ID, sig: str) -> str:
+        return '%s.%s.%s.%s' % (self.db_name, self.tbl_name, identifier, sig)
+
+    def __messages_cache_name(self, identifier: ID) -> str:
+        return '%s.%s.%s.messages' % (self.db_name, self.tbl_name, identifier)
+
+    async def save_reliable_messages(self, messages: List[Tuple[ReliableMessage, ID]]) -> bool:
+        """ Save messages for receivers in one pipeline: [(message, receiver)] """
+        redis = self.redis
+        if redis is None:
+            return False
+        pipe = redis.pipeline(transaction=False)
+        for msg, receiver in messages:
+            sig = get_msg_sig(msg=msg)  # last 6 bytes (signature in base64)
+            # 1. save message: 'dkd.msg_inbox.{RECEIVER}.{SIG}
+            msg_key = self.__msg_cache_name(identifier=receiver, sig=sig)
+            value = utf8_encode(string=json_encode(container=msg.to_dict()))
+            pipe.set(name=msg_key, value=value, ex=self.EXPIRES)
+            # 2. append sig to an ordered set
+            messages_key = self.__messages_cache_name(identifier=receiver)
+            msg_time = msg.time
+            timestamp = 0 if msg_time is None else int(msg_time)
+            pipe.zadd(name=messages_key, mapping={sig: timestamp})
+        pipe.execute()
+        return True
+
+    async def remove_reliable_messages(self, messages: List[ReliableMessage], receiver: ID) -> bool:
+        """ Remove messages for receiver in one pipeline """
+        redis = self.redis
+        if redis is None:
+            return False
+        signatures = [get_msg_sig(msg=msg) for msg in messages]
+        if len(signatures) == 0:
+            return True
+        pipe = redis.pipeline(transaction=False)
+        # 1. delete messages: 'dkd.msg_inbox.{RECEIVER}.{SIG}
+        pipe.delete(*[self.__msg_cache_name(identifier=receiver, sig=sig) for sig in signatures])
+        # 2. delete signatures from the ordered set
+        messages_key = self.__messages_cache_name(identifier=receiver)
+        pipe.zrem(messages_key, *[utf8_encode(string=sig) for sig in signatures])
+        pipe.execute()
+        return True
+
+    async def get_message_signatures(self, receiver: ID) -> List[str]:
+        """ Get signatures of all messages in the last 7 days (oldest first) """
+        # 0. clear expired messages (7 days ago)
+        key = self.__messages_cache_name(identifier=receiver)
+        expired = int(DateTime.current_timestamp()) - self.EXPIRES
+        await self.zremrangebyscore(name=key, min_score=1, max_score=expired)
+        # 1. get all signatures
+        signatures = await self.zrange(name=key, start=0, end=-1)
+        return [utf8_decode(data=sig) for sig in signatures]
+
+    async def get_messages_with_signatures(self, signatures: List[str], receiver: ID) -> List[ReliableMessage]:
+        """ Get messages for receiver with signatures in one pipeline """
+        redis = self.redis
+        if redis is None or len(signatures) == 0:
+            return []
+        pipe = redis.pipeline(transaction=False)
+        for sig in signatures:
+            pipe.get(name=self.__msg_cache_name(identifier=receiver, sig=sig))
+        array = []
+        for value in pipe.execute():
+            if value is None:
+                continue
+            try:
+                js = utf8_decode(data=value)
+                dictionary = json_decode(string=js)
+                msg = ReliableMessage.parse(msg=dictionary)
+                array.append(msg)
+            except Exception as error:
+                print('[REDIS] message error: %s => %s' % (error, value))
+        return array
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MIT License
+#
+# Copyright (c) 2023 Albert Moky
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ==============================================================================
+
+from typing import Optional, Dict
+
+from redis.exceptions import WatchError
+
+from dimples import ID
+from ...utils import json_encode, json_decode, utf8_encode, utf8_decode
+from dimples.database.redis import RedisCache
+
+
+class GroupKeysHashCache(RedisCache):
+
+    # group keys cached in Redis will be removed after 30 minutes, after that
+    # it will be reloaded from local storage if it's still need.
+    EXPIRES = 1800  # seconds
+
+    @property  # Override
+    def db_name(self) -> Optional[str]:
+        return 'dkd'
+
+    @property  # Override
+    def tbl_name(self) -> str:
+        return 'group'
+
+    """
+        Encrypted keys
+        ~~~~~~~~~~~~~~
+
+        redis key: 'dkd.group.{GID}.{UID}.keys-table'
+
+        hash field: '{MEMBER}', 'digest', 'time' => JSON value
+    """
+    def __cache_name(self, group: ID, sender: ID) -> str:
+        return '%s.%s.%s.%s.keys-table' % (self.db_name, self.tbl_name, group, sender)
+
+    async def get_group_keys(self, group: ID, sender: ID) -> Optional[Dict[str, str]]:
+        name = self.__cache_name(group=group, sender=sender)
+        fields = await self.hgetall(name=name)
+        if fields is None or len(fields) == 0:
+            return None
+        keys = {}
+        for field, value in fields.items():
+            keys[utf8_decode(data=field)] = json_decode(string=utf8_decode(data=value))
+        return keys
+
+    async def save_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> bool:
+        """ replace the whole table """
+        redis = self.redis
+        if redis is None:
+            return False
+        name = self.__cache_name(group=group, sender=sender)
+        pipe = redis.pipeline(transaction=True)
+        pipe.delete(name)
+        if len(keys) > 0:
+            pipe.hset(name=name, mapping=_encode_fields(keys=keys))
+            pipe.expire(name=name, time=self.EXPIRES)
+        pipe.execute()
+        return True
+
+    async def update_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> bool:
+        """ update changed fields only, return False when the table not cached """
+        redis = self.redis
+        if redis is None:
+            return False
+        name = self.__cache_name(group=group, sender=sender)
+        with redis.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(name)
+                if not pipe.exists(name):
+                    # partial table is not allowed
+                    return False
+                pipe.multi()
+                pipe.hset(name=name, mapping=_encode_fields(keys=keys))
+                pipe.expire(name=name, time=self.EXPIRES)
+                pipe.execute()
+                return True
+            except WatchError:
+                # expired while updating
+                return False
+
+
+def _encode_fields(keys: Dict[str, str]) -> Dict[str, bytes]:
+    return {field: utf8_encode(string=json_encode(container=value)) for field, value in keys.items()}
@@ -31,7 +31,7 @@ from dimples.utils import Config
 from dimples.database import DbTask, DataCache
 
 from ..common.dbi import ActiveUser, ActiveUserDBI
-from .dos import ActiveUserStorage
+from .dos import ActiveUserStorage, ActiveUserJournal
 
 
 class UsvTask(DbTask[str, List[ActiveUser]]):
@@ -39,7 +39,7 @@ class UsvTask(DbTask[str, List[ActiveUser]]):
     MEM_CACHE_EXPIRES = 36000  # seconds
     MEM_CACHE_REFRESH = 128    # seconds
 
-    def __init__(self, storage: ActiveUserStorage,
+    def __init__(self, storage: ActiveUserDBI,
                  mutex_lock: threading.Lock, cache_pool: CachePool):
         super().__init__(mutex_lock=mutex_lock, cache_pool=cache_pool,
                          cache_expires=self.MEM_CACHE_EXPIRES,
@@ -64,7 +64,7 @@ class ActiveUserTable(DataCache, ActiveUserDBI):
 
     def __init__(self, config: Config):
         super().__init__(pool_name='dim_network')  # ID => List[ActiveUser]
-        self._dos = ActiveUserStorage(config=config)
+        self._dos = _create_storage(config=config)
 
     def show_info(self):
         self._dos.show_info()
@@ -87,3 +87,21 @@ class ActiveUserTable(DataCache, ActiveUserDBI):
         task = self._new_task()
         users = await task.load()
         return [] if users is None else users
+
+    # Override
+    async def append_active_users(self, users: List[ActiveUser]) -> bool:
+        with self.lock:
+            if await self._dos.append_active_users(users=users):
+                # the cached list is out of date now
+                self.cache.erase(key='active_users')
+                return True
+        return False
+
+
+def _create_storage(config: Config):
+    """ storage format: 'json' (default) or 'journal' """
+    fmt = config.get_string(section='database', option='active_users')
+    if fmt == 'journal':
+        return ActiveUserJournal(config=config)
+    else:
+        return ActiveUserStorage(config=config)
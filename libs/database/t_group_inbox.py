@@ -24,12 +24,13 @@
 # ==============================================================================
 
 import threading
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
 from dimples import ID
 from dimples import ReliableMessage
 from dimples import ReliableMessageDBI
 from dimples.utils import CachePool
+from dimples.utils import get_msg_sig
 from dimples.utils import Config
 from dimples.database import DbTask, DataCache
 
@@ -67,6 +68,10 @@ class MsgTask(DbTask[ID, List[ReliableMessage]]):
 class GroupInboxMessageTable(DataCache, ReliableMessageDBI):
     """ Implementations of ReliableMessageDBI """
 
+    CACHE_LIMIT = 1024  # max messages cached in memory for each receiver
+
+    PAGE_SIZE = 128  # messages loaded from redis server for each page
+
     def __init__(self, config: Config):
         super().__init__(pool_name='group_inbox')  # ID => List[ReliableMessages]
         self._redis = GroupInboxMessageCache(config=config)
@@ -80,6 +85,60 @@ class GroupInboxMessageTable(DataCache, ReliableMessageDBI):
                        redis=self._redis,
                        mutex_lock=self._mutex_lock, cache_pool=self._cache_pool)
 
+    def _cached_messages(self, receiver: ID) -> Optional[List[ReliableMessage]]:
+        value, _ = self.cache.fetch(key=receiver)
+        return value
+
+    def _cache_messages(self, receiver: ID, messages: List[ReliableMessage]):
+        self.cache.update(key=receiver, value=messages, life_span=MsgTask.MEM_CACHE_EXPIRES)
+
+    def _cache_append(self, receiver: ID, msg: ReliableMessage):
+        """ Append new message to the cached inbox (copy on write) """
+        messages = self._cached_messages(receiver=receiver)
+        if messages is None:
+            # not loaded yet, or expired
+            return
+        sig = get_msg_sig(msg=msg)
+        array = [item for item in messages if get_msg_sig(msg=item) != sig]
+        # keep the same order as redis: (timestamp, sig)
+        order = _sort_key(msg=msg)
+        pos = len(array)
+        while pos > 0 and _sort_key(msg=array[pos - 1]) > order:
+            pos -= 1
+        array.insert(pos, msg)
+        if len(array) > self.CACHE_LIMIT:
+            array = array[-self.CACHE_LIMIT:]
+        self._cache_messages(receiver=receiver, messages=array)
+
+    def _cache_remove(self, receiver: ID, removed: List[ReliableMessage]):
+        """ Remove messages from the cached inbox (copy on write) """
+        messages = self._cached_messages(receiver=receiver)
+        if messages is None:
+            # not loaded yet, or expired
+            return
+        signatures = set([get_msg_sig(msg=msg) for msg in removed])
+        array = [item for item in messages if get_msg_sig(msg=item) not in signatures]
+        if len(array) < len(messages):
+            self._cache_messages(receiver=receiver, messages=array)
+
+    async def message_pages(self, receiver: ID, page_size: int = None) -> AsyncIterator[List[ReliableMessage]]:
+        """
+        Load stored messages page by page (oldest first),
+        only the signatures are loaded at first, messages will be parsed when their page comes.
+
+        :param receiver:  receiver ID
+        :param page_size: max messages in one page
+        :return: async iterator of pages
+        """
+        if page_size is None or page_size <= 0:
+            page_size = self.PAGE_SIZE
+        signatures = await self._redis.get_message_signatures(receiver=receiver)
+        for start in range(0, len(signatures), page_size):
+            page = signatures[start:start + page_size]
+            messages = await self._redis.get_messages_with_signatures(signatures=page, receiver=receiver)
+            if len(messages) > 0:
+                yield messages
+
     #
     #   ReliableMessageDBI
     #
@@ -95,15 +154,43 @@ class GroupInboxMessageTable(DataCache, ReliableMessageDBI):
         with self.lock:
             # 1. store into redis server
             if await self._redis.save_reliable_message(msg=msg, receiver=receiver):
-                # 2. clear cache to reload
-                self.cache.erase(key=receiver)
+                # 2. append to the cached inbox
+                self._cache_append(receiver=receiver, msg=msg)
+                return True
+
+    async def cache_reliable_messages(self, messages: List[Tuple[ReliableMessage, ID]]) -> bool:
+        """ Store messages for many receivers at once: [(message, receiver)] """
+        with self.lock:
+            # 1. store into redis server with one round trip
+            if await self._redis.save_reliable_messages(messages=messages):
+                # 2. append to the cached inboxes
+                for msg, receiver in messages:
+                    self._cache_append(receiver=receiver, msg=msg)
                 return True
+            return False
 
     # Override
     async def remove_reliable_message(self, msg: ReliableMessage, receiver: ID) -> bool:
         with self.lock:
             # 1. remove from redis server
             if await self._redis.remove_reliable_message(msg=msg, receiver=receiver):
-                # 2. clear cache to reload
-                self.cache.erase(key=receiver)
+                # 2. remove from the cached inbox
+                self._cache_remove(receiver=receiver, removed=[msg])
                 return True
+
+    async def remove_reliable_messages(self, messages: List[ReliableMessage], receiver: ID) -> bool:
+        """ Remove delivered messages for receiver at once """
+        with self.lock:
+            # 1. remove from redis server with one round trip
+            if await self._redis.remove_reliable_messages(messages=messages, receiver=receiver):
+                # 2. remove from the cached inbox
+                self._cache_remove(receiver=receiver, removed=messages)
+                return True
+            return False
+
+
+def _sort_key(msg: ReliableMessage) -> Tuple[int, str]:
+    """ score & member in the redis ordered set """
+    msg_time = msg.time
+    timestamp = 0 if msg_time is None else int(msg_time)
+    return timestamp, get_msg_sig(msg=msg)
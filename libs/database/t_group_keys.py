@@ -30,22 +30,28 @@ from dimples import ID
 
 from dimples.utils import CachePool
 from dimples.common import GroupKeysDBI
-from dimples.database import GroupKeysStorage
-from dimples.database import GroupKeysCache
 from dimples.utils import Config
 from dimples.database import DbTask, DataCache
 
+from ..utils import BoundedCachePool
+
+from .redis import GroupKeysHashCache
+from .dos import GroupKeysJournal
+
 
 class PwdTask(DbTask[Tuple[ID, ID], Dict[str, str]]):
 
     def __init__(self, group: ID, sender: ID,
-                 redis: GroupKeysCache, storage: GroupKeysStorage,
-                 mutex_lock: threading.Lock, cache_pool: CachePool):
+                 redis: GroupKeysHashCache, storage: GroupKeysJournal,
+                 mutex_lock: threading.Lock, cache_pool: CachePool,
+                 changed: Dict[str, str] = None):
         super().__init__(mutex_lock=mutex_lock, cache_pool=cache_pool)
         self._group = group
         self._sender = sender
         self._redis = redis
         self._dos = storage
+        # changed entries for the value to be saved, None means whole table changed
+        self._changed = changed
 
     @property  # Override
     def cache_key(self) -> Tuple[ID, ID]:
@@ -54,25 +60,33 @@ class PwdTask(DbTask[Tuple[ID, ID], Dict[str, str]]):
     # Override
     async def _read_data(self) -> Optional[Dict[str, str]]:
         # 1. the redis server will return None when cache not found
-        # 2. when redis server return an empty array, no need to check local storage again
         keys = await self._redis.get_group_keys(group=self._group, sender=self._sender)
         if keys is not None:
             return keys
-        # 3. the local storage will return None when file not found
+        # 2. the local storage will return None when file not found
         keys = await self._dos.get_group_keys(group=self._group, sender=self._sender)
         if keys is None:
-            # 4. return empty dictionary as a placeholder for the memory cache
-            keys = {}
-        # 5. update redis server
+            # 3. return empty dictionary as a placeholder for the memory cache
+            return {}
+        # 4. update redis server
         await self._redis.save_group_keys(group=self._group, sender=self._sender, keys=keys)
         return keys
 
     # Override
     async def _write_data(self, value: Dict[str, str]) -> bool:
-        # 1. store into redis server
-        ok1 = await self._redis.save_group_keys(group=self._group, sender=self._sender, keys=value)
-        # 2. save into local storage
-        ok2 = await self._dos.save_group_keys(group=self._group, sender=self._sender, keys=value)
+        changed = self._changed
+        if changed is None:
+            ok1 = ok2 = False
+        else:
+            # 1. update changed entries only
+            ok1 = await self._redis.update_group_keys(group=self._group, sender=self._sender, keys=changed)
+            ok2 = await self._dos.append_group_keys(group=self._group, sender=self._sender, keys=changed)
+        # 2. store the whole table into redis server
+        if not ok1:
+            ok1 = await self._redis.save_group_keys(group=self._group, sender=self._sender, keys=value)
+        # 3. save the whole table into local storage
+        if not ok2:
+            ok2 = await self._dos.save_group_keys(group=self._group, sender=self._sender, keys=value)
         return ok1 or ok2
 
 
@@ -81,23 +95,39 @@ class GroupKeysTable(DataCache, GroupKeysDBI):
 
     def __init__(self, config: Config):
         super().__init__(pool_name='group.keys')  # (ID, ID) => Dict
-        self._redis = GroupKeysCache(config=config)
-        self._dos = GroupKeysStorage(config=config)
+        # bounded by bytes instead of the shared pool
+        max_bytes = config.get_integer(section='database', option='group_keys_memory')
+        self._cache_pool = BoundedCachePool(sizer=_estimate_size, max_bytes=max_bytes)
+        self._redis = GroupKeysHashCache(config=config)
+        self._dos = GroupKeysJournal(config=config)
 
     def show_info(self):
         self._dos.show_info()
 
-    def _new_task(self, group: ID, sender: ID) -> PwdTask:
+    @property
+    def cache_stats(self) -> Dict[str, int]:
+        """ memory cache metrics: items, bytes, hits, misses, evictions """
+        return self._cache_pool.stats
+
+    def _new_task(self, group: ID, sender: ID, changed: Dict[str, str] = None) -> PwdTask:
         return PwdTask(group=group, sender=sender,
                        redis=self._redis, storage=self._dos,
-                       mutex_lock=self._mutex_lock, cache_pool=self._cache_pool)
-
-    async def _merge_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> Optional[Dict[str, str]]:
-        # 0. load old records
-        table = await self.get_group_keys(group=group, sender=sender)
-        if table is None:
+                       mutex_lock=self._mutex_lock, cache_pool=self._cache_pool,
+                       changed=changed)
+
+    # noinspection PyMethodMayBeStatic
+    def _merge_keys(self, table: Optional[Dict[str, str]],
+                    keys: Dict[str, str]) -> Tuple[Optional[Dict[str, str]], Optional[Dict[str, str]]]:
+        """
+        Merge new keys into the old table
+
+        :return: (None, None) when the new keys are expired;
+                 (keys, None) when the whole table changed;
+                 (table, changed entries) when merged with the old table
+        """
+        if table is None or len(table) == 0:
             # new keys
-            return keys
+            return keys, None
         # 1. check times
         old_time = table.get('time')
         new_time = keys.get('time')
@@ -105,26 +135,75 @@ class GroupKeysTable(DataCache, GroupKeysDBI):
         if old_time is not None:
             if new_time is None:
                 # error
-                return None
+                return None, None
             elif float(new_time) < float(old_time):
                 # expired records, drop them
-                return None
+                return None, None
         # 2. check digest
         old_digest = table.get('digest')
         new_digest = keys.get('digest')
         if old_digest is None or new_digest is None:
             # FIXME: old version?
-            return keys
+            return keys, None
         elif old_digest != new_digest:
             # key changed
-            return keys
-        # 3. same digest, merge keys
+            return keys, None
+        # 3. same digest, merge changed keys only
+        changed = self._changed_keys(table=table, keys=keys)
+        if len(changed) == 0:
+            # nothing changed, return the old table itself
+            return table, changed
+        # table['digest'] = new_digest
+        if new_time is not None:
+            changed['time'] = new_time
         table = table.copy()
+        table.update(changed)
+        return table, changed
+
+    # noinspection PyMethodMayBeStatic
+    def _changed_keys(self, table: Dict[str, str], keys: Dict[str, str]) -> Dict[str, str]:
+        """ Get member keys which are new or different from the old table (with same digest) """
+        changed = {}
         for member in keys:
-            # update key for member
-            table[member] = keys[member]
-        # table['digest'] = new_digest
-        # table['time'] = new_time
+            if member == 'time':
+                # a newer time without new keys is not worth saving
+                continue
+            value = keys[member]
+            if table.get(member) != value:
+                changed[member] = value
+        return changed
+
+    async def _save_keys(self, group: ID, sender: ID,
+                         keys: Dict[str, str]) -> Tuple[Optional[Dict[str, str]], Optional[bool]]:
+        """ Load once, merge once, and save changed entries; return (newest table, saved) """
+        # 0. load old records
+        table = await self._new_task(group=group, sender=sender).load()
+        # 1. merge with new keys
+        merged, changed = self._merge_keys(table=table, keys=keys)
+        if merged is None:
+            # expired keys, keep the old records
+            return table, False
+        elif merged is table:
+            # nothing changed, no need to save again
+            return table, None
+        # 2. save merged keys
+        task = self._new_task(group=group, sender=sender, changed=changed)
+        ok = await task.save(value=merged)
+        if not ok:
+            self.error(msg='failed to save group keys: %s => %s' % (sender, group))
+        return merged, ok
+
+    async def update_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """
+        Merge new keys with the stored ones and save them,
+        load once, merge once, and return the newest table
+
+        :param group:  group ID
+        :param sender: keys sender
+        :param keys:   new keys
+        :return: the stored table when new keys expired
+        """
+        table, _ = await self._save_keys(group=group, sender=sender, keys=keys)
         return table
 
     #
@@ -133,13 +212,22 @@ class GroupKeysTable(DataCache, GroupKeysDBI):
 
     # Override
     async def save_group_keys(self, group: ID, sender: ID, keys: Dict[str, str]) -> bool:
-        keys = await self._merge_keys(group=group, sender=sender, keys=keys)
-        if keys is None:
-            return False
-        task = self._new_task(group=group, sender=sender)
-        return await task.save(value=keys)
+        _, ok = await self._save_keys(group=group, sender=sender, keys=keys)
+        # None means nothing changed
+        return ok is not False
 
     # Override
     async def get_group_keys(self, group: ID, sender: ID) -> Optional[Dict[str, str]]:
         task = self._new_task(group=group, sender=sender)
         return await task.load()
+
+
+def _estimate_size(keys: Optional[Dict[str, str]]) -> int:
+    """ rough memory bytes of a keys table """
+    if keys is None:
+        return 64
+    size = 232
+    for member in keys:
+        # item slot + key string + value object
+        size += 128 + len(member) + len(str(keys[member]))
+    return size
@@ -42,6 +42,9 @@ from .pnf import get_filename, get_extension
 from .pnf import get_cache_name
 from .pnf import filename_from_url, filename_from_data
 
+from .queue import WaitingQueue
+from .cache import BoundedCachePool
+
 from .md import md_esc
 from .md import md_user_url
 
@@ -86,6 +89,9 @@ __all__ = [
     'get_cache_name',
     'filename_from_url', 'filename_from_data',
 
+    'WaitingQueue',
+    'BoundedCachePool',
+
     #
     #   Others
     #
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MIT License
+#
+# Copyright (c) 2026 Albert Moky
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ==============================================================================
+
+"""
+    Bounded Cache Pool
+    ~~~~~~~~~~~~~~~~~~
+
+    Memory cache pool limited by the estimated bytes of values,
+    the least recently used holders will be evicted when it's full.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Optional, Callable, Tuple, Set, Dict
+
+from aiou.mem import CachePool
+from aiou.mem.cache import CacheHolder
+from aiou.mem.cache import K, V
+
+
+class BoundedCachePool(CachePool, Generic[K, V]):
+
+    MAX_BYTES = 64 * 1024 * 1024  # 64 MiB
+
+    PURGE_INTERVAL = 300  # seconds
+
+    def __init__(self, sizer: Callable[[Optional[V]], int], max_bytes: int = None):
+        super().__init__()
+        if max_bytes is None or max_bytes <= 0:
+            max_bytes = self.MAX_BYTES
+        self.__sizer = sizer
+        self.__max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        # key -> (holder, size), in order of recently used
+        self.__holders: OrderedDict[K, Tuple[CacheHolder[V], int]] = OrderedDict()
+        self.__total = 0
+        self.__next_purge = time.time() + self.PURGE_INTERVAL
+        # metrics
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self.__max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, size: int):
+        assert size > 0, 'cache size error: %d' % size
+        with self.__lock:
+            self.__max_bytes = size
+            self.__evict()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """ cache metrics """
+        with self.__lock:
+            return {
+                'items': len(self.__holders),
+                'bytes': self.__total,
+                'max_bytes': self.__max_bytes,
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+            }
+
+    def __remove(self, key: K):
+        item = self.__holders.pop(key, None)
+        if item is not None:
+            self.__total -= item[1]
+
+    def __evict(self):
+        holders = self.__holders
+        # the newest holder is kept even if it's too big
+        while self.__total > self.__max_bytes and len(holders) > 1:
+            _, item = holders.popitem(last=False)
+            self.__total -= item[1]
+            self.__evictions += 1
+
+    # Override
+    def all_keys(self) -> Set[K]:
+        with self.__lock:
+            return set(self.__holders.keys())
+
+    # Override
+    def update(self, key: K, holder: CacheHolder[V] = None,
+               value: V = None, life_span: float = 3600, now: float = None) -> CacheHolder[V]:
+        if life_span is None:
+            life_span = 3600
+        if holder is None:
+            holder = CacheHolder(value=value, life_span=life_span, now=now)
+        size = self.__sizer(holder.value)
+        with self.__lock:
+            self.__remove(key=key)
+            self.__holders[key] = (holder, size)
+            self.__total += size
+            self.__evict()
+        # purge expired holders periodically
+        if now is None:
+            now = time.time()
+        if now > self.__next_purge:
+            self.__next_purge = now + self.PURGE_INTERVAL
+            self.purge(now=now)
+        return holder
+
+    # Override
+    def erase(self, key: K, now: float = None) -> Tuple[Optional[V], Optional[CacheHolder[V]]]:
+        if now is None:
+            with self.__lock:
+                self.__remove(key=key)
+            return None, None
+        # get exists value before erasing
+        value, holder = self.fetch(key=key, now=now)
+        with self.__lock:
+            self.__remove(key=key)
+        return value, holder
+
+    # Override
+    def fetch(self, key: K, now: float = None) -> Tuple[Optional[V], Optional[CacheHolder[V]]]:
+        with self.__lock:
+            item = self.__holders.get(key)
+            if item is None:
+                # holder not found
+                self.__misses += 1
+                return None, None
+            self.__holders.move_to_end(key)
+            holder = item[0]
+            if holder.is_alive(now=now):
+                self.__hits += 1
+                return holder.value, holder
+            else:
+                # holder expired
+                self.__misses += 1
+                return None, holder
+
+    # Override
+    def purge(self, now: float = None) -> int:
+        if now is None:
+            now = time.time()
+        with self.__lock:
+            expired = [key for key, item in self.__holders.items() if item[0].is_deprecated(now=now)]
+            for key in expired:
+                self.__remove(key=key)
+            return len(expired)
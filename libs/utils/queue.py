@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# MIT License
+#
+# Copyright (c) 2026 Albert Moky
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ==============================================================================
+
+"""
+    Waiting Queue
+    ~~~~~~~~~~~~~
+
+    Thread-safe FIFO queue for producers running in any thread,
+    the consumer can await on it and will be woken up immediately
+    when a new item appended.
+"""
+
+import asyncio
+import threading
+from collections import deque
+from typing import Generic, TypeVar
+from typing import Optional, Dict, Deque
+
+V = TypeVar('V')
+
+
+class WaitingQueue(Generic[V]):
+
+    def __init__(self):
+        super().__init__()
+        self.__items: Deque[V] = deque()
+        self.__lock = threading.Lock()
+        # waiting consumers: loop => event
+        self.__waiters: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+
+    @property
+    def size(self) -> int:
+        """ depth of the queue """
+        return len(self.__items)
+
+    def append(self, item: V) -> int:
+        """ Append item to the tail, wake up the consumers """
+        with self.__lock:
+            self.__items.append(item)
+            count = len(self.__items)
+            # remove consumers which event loop stopped
+            closed = [loop for loop in self.__waiters if loop.is_closed()]
+            for loop in closed:
+                self.__waiters.pop(loop, None)
+            waiters = list(self.__waiters.items())
+        for loop, event in waiters:
+            _wakeup(loop=loop, event=event)
+        return count
+
+    def pop(self) -> Optional[V]:
+        """ Remove & return the head item, None on empty """
+        with self.__lock:
+            if len(self.__items) > 0:
+                return self.__items.popleft()
+
+    async def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until the queue is not empty
+
+        :param timeout: max waiting time in seconds
+        :return: False on timeout
+        """
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            if len(self.__items) > 0:
+                return True
+            event = self.__waiters.get(loop)
+            if event is None:
+                event = asyncio.Event()
+                self.__waiters[loop] = event
+            else:
+                event.clear()
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return len(self.__items) > 0
+
+
+def _wakeup(loop: asyncio.AbstractEventLoop, event: asyncio.Event):
+    try:
+        loop.call_soon_threadsafe(event.set)
+    except RuntimeError:
+        # event loop closed
+        pass